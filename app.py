@@ -3,7 +3,7 @@
 #  Conecta ao MySQL e expõe todas as rotas da API
 # ============================================================
 
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from flask import Flask, request, jsonify, send_from_directory, render_template, make_response, redirect
 from flask_cors import CORS
 import pymysql
 import pymysql.cursors
@@ -13,11 +13,28 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 import secrets
+import atexit
 import string
 from datetime import datetime, timedelta
 from functools import wraps
+from collections import OrderedDict
 import uuid
+import re
+import json
+import gzip
+import mimetypes
+import tempfile
+import time
+import base64
+import hashlib
+import unicodedata
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TempoEsgotado
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
+from jinja2 import FileSystemBytecodeCache
 
 # ── JWT opcional (instale: pip install PyJWT) ──────────────
 try:
@@ -27,6 +44,20 @@ except ImportError:
     JWT_DISPONIVEL = False
     print("⚠ PyJWT não instalado. Autenticação via token desativada.")
 
+# ── Pillow opcional (instale: pip install Pillow) ──────────
+try:
+    from PIL import Image, ImageOps
+    PIL_DISPONIVEL = True
+except ImportError:
+    PIL_DISPONIVEL = False
+    print("⚠ Pillow não instalado. Variantes WebP/redimensionadas desativadas.")
+
+# ── Brotli opcional (pip install brotli) — sem ele, só gzip ─
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # ============================================================
 #  CONFIGURAÇÕES
 # ============================================================
@@ -34,6 +65,17 @@ except ImportError:
 app = Flask(__name__, static_folder='.', template_folder='templates')
 CORS(app, supports_credentials=True)
 
+# ── Proxy reverso (easypanel/nginx) ────────────────────────
+# Quantos proxies confiáveis acrescentam X-Forwarded-For à frente do app.
+# Padrão 0: sem proxy, o X-Forwarded-For vem do próprio cliente e confiar
+# nele deixaria qualquer um trocar de IP a cada tentativa e escapar dos
+# limitadores por IP. Em produção atrás do easypanel/nginx, defina
+# PROXY_HOPS=1 — senão remote_addr é o IP do proxy e todos os clientes
+# dividem o mesmo balde.
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
 # Injeta `now` em todos os templates Jinja2 (para o ano no footer)
 from datetime import datetime
 @app.context_processor
@@ -53,26 +95,172 @@ DB_CONFIG = {
     'autocommit': True,
 }
 
+# ── Pool de conexões (um por worker gunicorn) ──────────────
+DB_POOL_MAX       = int(os.environ.get('DB_POOL_MAX', 8))       # conexões por worker
+DB_POOL_TIMEOUT   = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # espera máx. por conexão (s)
+DB_POOL_PING_APOS = 30   # segundos ociosa antes de validar com ping no checkout
+
+# ── Cache HTTP dos endpoints públicos do catálogo ──────────
+CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', 60))    # segundos
+CACHE_SWR     = int(os.environ.get('CACHE_SWR', 300))       # stale-while-revalidate
+CACHE_CONTROL_PUBLICO = (f'public, max-age={CACHE_MAX_AGE}, '
+                         f'stale-while-revalidate={CACHE_SWR}')
+
+# ── Assets estáticos (gerados por build_assets.py) ─────────
+ASSETS_MANIFESTO = os.path.join('assets', 'dist', 'manifest.json')
+CACHE_CONTROL_IMUTAVEL = 'public, max-age=31536000, immutable'
+
+# ── Páginas Jinja (HTML renderizado em memória + bytecode em disco) ──
+PAGINA_CACHE_CHECAGEM = 2   # segundos entre conferências do mtime de templates/
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR',
+                                 os.path.join(tempfile.gettempdir(), 'spinassi-jinja'))
+
 # ── JWT ────────────────────────────────────────────────────
 JWT_SECRET  = os.environ.get('JWT_SECRET', 'spinassi-secret-mude-em-producao-2024')
 JWT_EXPIRES = 24  # horas
+JWT_CACHE_MAX = int(os.environ.get('JWT_CACHE_MAX', 4096))  # tokens verificados em memória
+
+# ── Hash de senhas (executor dedicado) ─────────────────────
+SENHA_METODO   = os.environ.get('SENHA_METODO', 'scrypt:32768:8:1')  # custo-alvo dos hashes
+SENHA_WORKERS  = int(os.environ.get('SENHA_WORKERS', 2))      # threads de hash por worker
+SENHA_FILA_MAX = int(os.environ.get('SENHA_FILA_MAX', 16))    # acima disso responde 503
+SENHA_TIMEOUT  = float(os.environ.get('SENHA_TIMEOUT', 10))   # espera máx. por um hash (s)
+
+# ── Limite de tentativas (token bucket) ────────────────────
+# (rajada, fichas repostas por minuto)
+LIMITE_LOGIN_IP          = (20, 10)   # por IP
+LIMITE_LOGIN_EMAIL       = (5, 2)     # por e-mail tentado
+LIMITE_RECUPERACAO_IP    = (5, 1)
+LIMITE_RECUPERACAO_EMAIL = (2, 0.1)   # ~1 e-mail a cada 10 min
+LIMITE_MAX_CHAVES        = 50000      # baldes em memória por limitador (LRU)
 
 # ── E-mail ─────────────────────────────────────────────────
 EMAIL_CONFIG = {
-    'smtp_server': 'smtp.gmail.com',
-    'smtp_port':   587,
+    'smtp_server': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+    'smtp_port':   int(os.environ.get('SMTP_PORT', 587)),
+    'starttls':    os.environ.get('SMTP_STARTTLS', '1') == '1',  # 0 p/ SMTP local de testes
     'email':       'seu-email@gmail.com',       # ← substitua
-    'senha':       'sua-senha-de-app',          # ← substitua
+    'senha':       'sua-senha-de-app',          # ← substitua (vazio = sem login)
     'destinatario':'contato@spinassichocolates.com',
 }
 
+# ── Fila de e-mails (outbox) ───────────────────────────────
+EMAIL_LOTE           = 20    # mensagens por varredura da fila
+EMAIL_INTERVALO      = 5     # segundos entre varreduras
+EMAIL_MAX_TENTATIVAS = 6     # depois disso a mensagem fica como 'falhou'
+EMAIL_SMTP_OCIOSO    = 60    # fecha a sessão SMTP após N segundos sem uso
+
+# ── Log de atividades (gravação em lote) ───────────────────
+LOG_LOTE       = 100     # grava assim que o buffer atinge N eventos
+LOG_INTERVALO  = 2       # ... ou a cada N segundos
+LOG_MAX_BUFFER = 10000   # acima disso novos eventos são descartados
+
 # ============================================================
 #  HELPERS DE BANCO
 # ============================================================
 
+class PoolConexoes:
+    """
+    Pool limitado e thread-safe de conexões PyMySQL.
+    Cada worker mantém no máximo `maximo` conexões abertas; quem passar
+    do limite espera até `timeout` segundos por uma conexão livre.
+    """
+
+    def __init__(self, config, maximo, timeout):
+        self.config  = config
+        self.maximo  = maximo
+        self.timeout = timeout
+        self._iniciar()
+
+    def _iniciar(self):
+        self._pid    = os.getpid()
+        self._livres = queue.LifoQueue()   # (conexão, último uso)
+        self._vagas  = threading.BoundedSemaphore(self.maximo)
+        self._lock   = threading.Lock()
+        self._stats  = {'criadas': 0, 'reutilizadas': 0, 'reconectadas': 0,
+                        'descartadas': 0, 'esgotado': 0, 'em_uso': 0}
+
+    def _contar(self, chave, n=1):
+        with self._lock:
+            self._stats[chave] += n
+
+    def _obter(self):
+        # Após o fork do gunicorn (--preload) o pool herdado não é reaproveitado
+        if os.getpid() != self._pid:
+            self._iniciar()
+        if not self._vagas.acquire(timeout=self.timeout):
+            self._contar('esgotado')
+            raise pymysql.err.OperationalError(2003, 'Pool de conexões esgotado')
+        try:
+            try:
+                conn, ultimo_uso = self._livres.get_nowait()
+            except queue.Empty:
+                conn = pymysql.connect(**self.config)
+                self._contar('criadas')
+            else:
+                if time.monotonic() - ultimo_uso > DB_POOL_PING_APOS:
+                    try:
+                        conn.ping(reconnect=False)
+                    except Exception:
+                        conn.ping(reconnect=True)
+                        self._contar('reconectadas')
+                self._contar('reutilizadas')
+        except Exception:
+            self._vagas.release()
+            raise
+        self._contar('em_uso')
+        return conn
+
+    def _devolver(self, conn, descartar=False):
+        self._contar('em_uso', -1)
+        try:
+            if descartar or not conn.open:
+                self._contar('descartadas')
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            else:
+                self._livres.put((conn, time.monotonic()))
+        finally:
+            self._vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        conn = self._obter()
+        descartar = False
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            descartar = True
+            raise
+        finally:
+            self._devolver(conn, descartar)
+
+    def stats(self):
+        with self._lock:
+            dados = dict(self._stats)
+        dados['livres'] = self._livres.qsize()
+        dados['maximo'] = self.maximo
+        return dados
+
+
+POOL = PoolConexoes(DB_CONFIG, DB_POOL_MAX, DB_POOL_TIMEOUT)
+
+
 def get_db():
-    """Abre uma nova conexão com o banco."""
-    return pymysql.connect(**DB_CONFIG)
+    """Empresta uma conexão do pool. Use como: `with get_db() as conn:`."""
+    return POOL.conexao()
+
+
+def _executar(conn, sql, params=None, fetch='all'):
+    with conn.cursor() as cur:
+        cur.execute(sql, params or ())
+        if fetch == 'all':
+            return cur.fetchall(), cur.lastrowid
+        if fetch == 'one':
+            return cur.fetchone(), cur.lastrowid
+        return None, cur.lastrowid
 
 
 def query(sql, params=None, fetch='all'):
@@ -81,28 +269,178 @@ def query(sql, params=None, fetch='all'):
     fetch = 'all' | 'one' | 'none'
     Retorna (resultado, lastrowid)
     """
-    conn = get_db()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(sql, params or ())
-            if fetch == 'all':
-                return cur.fetchall(), cur.lastrowid
-            if fetch == 'one':
-                return cur.fetchone(), cur.lastrowid
-            return None, cur.lastrowid
-    finally:
-        conn.close()
+    with get_db() as conn:
+        return _executar(conn, sql, params, fetch)
+
+
+class Transacao:
+    """Statements executados na mesma conexão, dentro de um único BEGIN/COMMIT."""
+
+    def __init__(self, conn):
+        self.conn = conn
 
+    def query(self, sql, params=None, fetch='all'):
+        """Mesma assinatura e retorno de query()."""
+        return _executar(self.conn, sql, params, fetch)
 
-def ok(data=None, msg='ok', code=200):
+    def execute(self, sql, params=None):
+        """Executa um statement e retorna o número de linhas afetadas."""
+        with self.conn.cursor() as cur:
+            return cur.execute(sql, params or ())
+
+    def executemany(self, sql, seq_params):
+        """INSERT ... VALUES com várias linhas num único round-trip. Retorna rowcount."""
+        with self.conn.cursor() as cur:
+            return cur.executemany(sql, seq_params)
+
+
+@contextmanager
+def transaction():
+    """
+    Unidade de trabalho:
+
+        with transaction() as tx:
+            tx.query(...)
+            tx.query(...)
+
+    Faz COMMIT ao sair do bloco; qualquer exceção desfaz tudo (ROLLBACK).
+    """
+    with get_db() as conn:
+        conn.begin()
+        try:
+            yield Transacao(conn)
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+
+
+def ok(data=None, msg='ok', code=200, **extra):
     resp = {'success': True, 'message': msg}
+    if data is not None:
+        resp['data'] = data
+    resp.update(extra)
+    return jsonify(resp), code
+
+
+def ok_cacheavel(data, versao=None, **extra):
+    """
+    Como ok(), mas com ETag forte + Cache-Control e resposta 304 quando o
+    If-None-Match do cliente confere.
+    Com `versao` (carimbo do catálogo) o ETag sai sem serializar o corpo;
+    sem ela, o ETag é o hash do próprio JSON.
+    """
+    if versao is not None:
+        etag = hashlib.sha1(f'{versao}|{request.full_path}'.encode()).hexdigest()
+        if etag in request.if_none_match:
+            resp = make_response('', 304)
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = CACHE_CONTROL_PUBLICO
+            return resp
+    resp, _ = ok(data, **extra)
+    if versao is None:
+        etag = hashlib.sha1(resp.get_data()).hexdigest()
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = CACHE_CONTROL_PUBLICO
+    return resp.make_conditional(request)
+
+
+def err(msg='Erro interno', code=400, data=None):
+    resp = {'success': False, 'message': msg}
     if data is not None:
         resp['data'] = data
     return jsonify(resp), code
 
+# ── Paginação por cursor (keyset) ──────────────────────────
+def cursor_codificar(*chave):
+    """Token opaco com a chave de ordenação do último item da página."""
+    bruto = json.dumps(chave, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def cursor_decodificar(token, tamanho=2):
+    """Inverso de cursor_codificar(); levanta ValueError se o token for inválido."""
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except Exception:
+        raise ValueError('Cursor inválido')
+    if not isinstance(chave, list) or len(chave) != tamanho:
+        raise ValueError('Cursor inválido')
+    return chave
+
+
+def limite_pagina(padrao, maximo):
+    """?limite= da requisição, limitado a 1..maximo (padrao se ausente ou inválido)."""
+    try:
+        limite = int(request.args.get('limite', padrao))
+    except ValueError:
+        limite = padrao
+    return max(1, min(limite, maximo))
+
 
-def err(msg='Erro interno', code=400):
-    return jsonify({'success': False, 'message': msg}), code
+def limite_admin():
+    """
+    Limite das listagens do painel: completas (None) enquanto o painel não
+    segue o cursor `proximo`; paginadas só com ?limite= ou ?after=.
+    """
+    if 'limite' in request.args or 'after' in request.args:
+        return limite_pagina(200, 200)
+    return None
+
+
+def pagina_keyset(sql, where, params, after, limite, col_data, col_id):
+    """
+    Executa `sql` (com {where} no lugar do WHERE) ordenado por
+    col_data DESC, col_id DESC, retomando depois do cursor `after`.
+    Com limite=None devolve tudo a partir do cursor, sem LIMIT.
+    Retorna (linhas, próximo_cursor | None).
+    """
+    where, params = list(where), list(params)
+    if after:
+        data, ultimo_id = cursor_decodificar(after)
+        where.append(f'({col_data} < %s OR ({col_data} = %s AND {col_id} < %s))')
+        params += [data, data, ultimo_id]
+    clausula = ('WHERE ' + ' AND '.join(where)) if where else ''
+    sql = sql.format(where=clausula) + f' ORDER BY {col_data} DESC, {col_id} DESC'
+    if limite is None:
+        rows, _ = query(sql, tuple(params))
+        return list(rows or []), None
+    rows, _ = query(sql + ' LIMIT %s', tuple(params) + (limite + 1,))
+    rows = list(rows or [])
+    proximo = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        proximo = cursor_codificar(rows[-1][col_data.split('.')[-1]], rows[-1]['id'])
+    return rows, proximo
+
+# ── Cache com expiração (por worker) ───────────────────────
+class CacheTTL:
+    """Valores calculados guardados por `ttl` segundos, por chave."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._itens = {}   # chave → (expira_em, valor)
+
+    def obter(self, chave, carregar):
+        agora = time.monotonic()
+        item = self._itens.get(chave)
+        if item and item[0] > agora:
+            return item[1]
+        valor = carregar()
+        with self._lock:
+            self._itens[chave] = (agora + self.ttl, valor)
+        return valor
+
+    def invalidar(self, chave=None):
+        with self._lock:
+            if chave is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(chave, None)
 
 # ============================================================
 #  HELPERS DE JWT
@@ -124,6 +462,52 @@ def gerar_token(usuario_id, tipo):
     return token
 
 
+class CacheTokens:
+    """
+    LRU dos payloads de JWT já verificados, chaveado pelo SHA-256 do token.
+    Evita refazer o HS256 a cada chamada autenticada da mesma sessão;
+    uma entrada nunca é servida depois do `exp` do próprio token.
+    """
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._lock  = threading.Lock()
+        self._itens = OrderedDict()   # digest → payload
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def obter(self, chave):
+        with self._lock:
+            payload = self._itens.get(chave)
+            if payload is not None:
+                if payload.get('exp', 0) > time.time():
+                    self._itens.move_to_end(chave)
+                    self._stats['hits'] += 1
+                    return payload
+                del self._itens[chave]
+            self._stats['misses'] += 1
+        return None
+
+    def guardar(self, chave, payload):
+        if self.maximo <= 0:
+            return
+        with self._lock:
+            self._itens[chave] = payload
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, tamanho=len(self._itens), maximo=self.maximo)
+
+
+TOKENS_VERIFICADOS = CacheTokens(JWT_CACHE_MAX)
+
+
 def verificar_token(token):
     if not JWT_DISPONIVEL:
         return None
@@ -131,12 +515,18 @@ def verificar_token(token):
         return None
     # Remove prefixo "Bearer " caso venha duplicado
     token = token.replace('Bearer ', '').strip()
+    chave = hashlib.sha256(token.encode()).digest()
+    payload = TOKENS_VERIFICADOS.obter(chave)
+    if payload is not None:
+        return payload
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    TOKENS_VERIFICADOS.guardar(chave, payload)
+    return payload
 
 
 def requer_login(f):
@@ -175,36 +565,422 @@ def requer_admin(f):
         return f(*args, **kwargs)
     return decorated
 
+# ============================================================
+#  HASH DE SENHAS
+# ============================================================
+
+class HashOcupado(Exception):
+    """O executor de hash está saturado; a requisição é recusada na hora."""
+
+
+class ExecutorSenhas:
+    """
+    Roda generate/check_password_hash num pool de threads próprio e
+    limitado (scrypt/pbkdf2 liberam o GIL), para que uma rajada de logins
+    não trave as demais requisições do worker. Com SENHA_FILA_MAX
+    hashes pendentes, novos pedidos são recusados com HashOcupado em vez
+    de entrar na fila.
+    """
+
+    def __init__(self, metodo, workers, fila_max, timeout):
+        self.metodo   = metodo
+        # Prefixo expandido que o werkzeug grava no hash ('scrypt' vira
+        # 'scrypt:32768:8:1'): é com ele que precisa_rehash compara
+        self.prefixo  = generate_password_hash('x', metodo).split('$', 1)[0]
+        self.workers  = workers
+        self.fila_max = fila_max
+        self.timeout  = timeout
+        self._lock      = threading.Lock()
+        self._executor  = None
+        self._pid       = None
+        self._pendentes = 0
+        self._stats = {'concluidos': 0, 'rejeitados': 0, 'timeouts': 0,
+                       'rehash': 0, 'pico_pendentes': 0, 'latencia_total_ms': 0.0}
+
+    def _submeter(self, fn, *args):
+        with self._lock:
+            if self._pid != os.getpid():   # threads não sobrevivem ao fork
+                self._executor = ThreadPoolExecutor(self.workers,
+                                                    thread_name_prefix='hash-senha')
+                self._pid, self._pendentes = os.getpid(), 0
+            if self._pendentes >= self.fila_max:
+                self._stats['rejeitados'] += 1
+                raise HashOcupado('Muitas tentativas simultâneas. Tente novamente em instantes.')
+            self._pendentes += 1
+            self._stats['pico_pendentes'] = max(self._stats['pico_pendentes'], self._pendentes)
+        inicio = time.perf_counter()
+
+        def tarefa():
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._pendentes -= 1
+                    self._stats['concluidos'] += 1
+                    self._stats['latencia_total_ms'] += (time.perf_counter() - inicio) * 1000
+        return self._executor.submit(tarefa)
+
+    def _aguardar(self, futuro):
+        try:
+            return futuro.result(timeout=self.timeout)
+        except TempoEsgotado:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise HashOcupado('Serviço de autenticação sobrecarregado. Tente novamente.')
+
+    def gerar(self, senha):
+        return self._aguardar(self._submeter(generate_password_hash, senha, self.metodo))
+
+    def verificar(self, senha_hash, senha):
+        return self._aguardar(self._submeter(check_password_hash, senha_hash, senha))
+
+    def precisa_rehash(self, senha_hash):
+        """True se o hash foi gerado com método/custo diferente do alvo."""
+        return (senha_hash or '').split('$', 1)[0] != self.prefixo
+
+    def rehash_em_segundo_plano(self, usuario_id, senha_hash, senha):
+        """
+        Regrava o hash no custo-alvo após um login bem-sucedido, sem
+        segurar a resposta. Se o executor estiver cheio, fica para o
+        próximo login. O UPDATE só vale se o hash não mudou nesse meio-tempo.
+        """
+        def regravar():
+            query("UPDATE usuarios SET senha_hash=%s WHERE id=%s AND senha_hash=%s",
+                  (generate_password_hash(senha, self.metodo), usuario_id, senha_hash),
+                  fetch='none')
+            with self._lock:
+                self._stats['rehash'] += 1
+        try:
+            self._submeter(regravar)
+        except HashOcupado:
+            pass
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['pendentes'] = self._pendentes
+            s['em_fila']   = max(0, self._pendentes - self.workers)
+        s['latencia_media_ms'] = round(s.pop('latencia_total_ms') / s['concluidos'], 1) \
+            if s['concluidos'] else 0.0
+        s.update(metodo=self.metodo, workers=self.workers, fila_max=self.fila_max)
+        return s
+
+
+SENHAS = ExecutorSenhas(SENHA_METODO, SENHA_WORKERS, SENHA_FILA_MAX, SENHA_TIMEOUT)
+
+
+@app.errorhandler(HashOcupado)
+def hash_ocupado(e):
+    resp, code = err(str(e), 503)
+    resp.headers['Retry-After'] = '2'
+    return resp, code
+
+# ============================================================
+#  LIMITE DE TENTATIVAS
+# ============================================================
+
+class LimitadorTaxa:
+    """
+    Token bucket por chave (IP ou e-mail), em memória do worker.
+    Cada balde é só uma tupla (fichas, instante) num OrderedDict que
+    descarta as chaves menos recentes acima de LIMITE_MAX_CHAVES; a
+    decisão custa O(1) e vem antes de qualquer consulta ou hash.
+    Com vários workers gunicorn o limite efetivo é multiplicado por eles.
+    """
+
+    def __init__(self, nome, capacidade, por_minuto, maximo=LIMITE_MAX_CHAVES):
+        self.nome       = nome
+        self.capacidade = capacidade
+        self.taxa       = por_minuto / 60.0   # fichas por segundo
+        self.maximo     = maximo
+        self._lock   = threading.Lock()
+        self._baldes = OrderedDict()   # chave → (fichas, monotonic)
+        self._stats  = {'permitidos': 0, 'bloqueados': 0}
+
+    def consumir(self, chave):
+        """Gasta uma ficha. Retorna 0 se permitido, senão os segundos até a próxima."""
+        agora = time.monotonic()
+        with self._lock:
+            fichas, antes = self._baldes.get(chave, (self.capacidade, agora))
+            fichas = min(self.capacidade, fichas + (agora - antes) * self.taxa)
+            if fichas >= 1:
+                fichas -= 1
+                espera = 0
+                self._stats['permitidos'] += 1
+            else:
+                espera = (1 - fichas) / self.taxa
+                self._stats['bloqueados'] += 1
+            self._baldes[chave] = (fichas, agora)
+            self._baldes.move_to_end(chave)
+            if len(self._baldes) > self.maximo:
+                self._baldes.popitem(last=False)
+        return espera
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, chaves=len(self._baldes))
+
+
+LOGIN_POR_IP          = LimitadorTaxa('login_ip', *LIMITE_LOGIN_IP)
+LOGIN_POR_EMAIL       = LimitadorTaxa('login_email', *LIMITE_LOGIN_EMAIL)
+RECUPERACAO_POR_IP    = LimitadorTaxa('recuperacao_ip', *LIMITE_RECUPERACAO_IP)
+RECUPERACAO_POR_EMAIL = LimitadorTaxa('recuperacao_email', *LIMITE_RECUPERACAO_EMAIL)
+
+
+def limitar(*regras):
+    """
+    Recebe pares (limitador, chave) e devolve uma resposta 429 no primeiro
+    que recusar, ou None. Chaves vazias são ignoradas.
+    """
+    for limitador, chave in regras:
+        if not chave:
+            continue
+        espera = limitador.consumir(chave)
+        if espera:
+            resp, code = err('Muitas tentativas. Aguarde um pouco e tente novamente.', 429)
+            resp.headers['Retry-After'] = str(int(espera) + 1)
+            return resp, code
+    return None
+
 # ============================================================
 #  HELPERS DE E-MAIL
 # ============================================================
 
+class RemetenteEmail:
+    """
+    Envia em segundo plano as mensagens da tabela email_fila.
+    Uma thread por worker reserva lotes (FOR UPDATE SKIP LOCKED, então
+    vários workers não pegam a mesma mensagem), envia todos pela mesma
+    sessão SMTP — reaproveitada entre lotes — e registra o resultado.
+    Falhas voltam para a fila com backoff exponencial.
+    """
+
+    def __init__(self):
+        self._pid    = None
+        self._lock   = threading.Lock()
+        self._acordar = threading.Event()
+        self._smtp   = None
+        self._smtp_uso = 0.0
+        self._stats  = {'enviados': 0, 'falhas': 0, 'lotes': 0, 'sessoes_smtp': 0}
+
+    def garantir_ativo(self):
+        """Inicia a thread no worker atual (threads não sobrevivem ao fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid  = os.getpid()
+            self._smtp = None
+            threading.Thread(target=self._loop, name='remetente-email', daemon=True).start()
+
+    def acordar(self):
+        self._acordar.set()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(EMAIL_INTERVALO)
+            self._acordar.clear()
+            try:
+                while self.processar_lote() == EMAIL_LOTE:
+                    pass
+            except Exception as e:
+                print(f'[EMAIL] Erro ao processar a fila: {e}')
+            if self._smtp is not None and time.monotonic() - self._smtp_uso > EMAIL_SMTP_OCIOSO:
+                self._fechar_smtp()
+
+    def _sessao_smtp(self):
+        if self._smtp is not None and time.monotonic() - self._smtp_uso > 30:
+            try:
+                self._smtp.noop()
+            except Exception:
+                self._fechar_smtp()
+        if self._smtp is None:
+            srv = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'], timeout=20)
+            if EMAIL_CONFIG.get('starttls', True):
+                srv.starttls()
+            if EMAIL_CONFIG.get('senha'):
+                srv.login(EMAIL_CONFIG['email'], EMAIL_CONFIG['senha'])
+            self._smtp = srv
+            self._stats['sessoes_smtp'] += 1
+        self._smtp_uso = time.monotonic()
+        return self._smtp
+
+    def _fechar_smtp(self):
+        srv, self._smtp = self._smtp, None
+        if srv is not None:
+            try:
+                srv.quit()
+            except Exception:
+                pass
+
+    def processar_lote(self):
+        """Envia um lote da fila; retorna quantas mensagens foram reservadas."""
+        with transaction() as tx:
+            msgs, _ = tx.query(
+                """SELECT id, destinatario, assunto, html, tentativas FROM email_fila
+                   WHERE (status='pendente' AND proxima_tentativa <= NOW())
+                      OR (status='enviando' AND atualizado_em < NOW() - INTERVAL 10 MINUTE)
+                   ORDER BY id LIMIT %s
+                   FOR UPDATE SKIP LOCKED""",
+                (EMAIL_LOTE,)
+            )
+            if not msgs:
+                return 0
+            # atualizado_em explícito: ao retomar uma linha 'enviando' travada o
+            # status não muda, o ON UPDATE não dispara e ela continuaria "velha"
+            # para outro worker reservá-la de novo
+            placeholders = ','.join(['%s'] * len(msgs))
+            tx.query(f"""UPDATE email_fila SET status='enviando', atualizado_em=NOW()
+                          WHERE id IN ({placeholders})""",
+                     tuple(m['id'] for m in msgs), fetch='none')
+        self._stats['lotes'] += 1
+
+        enviados, falhas = [], []
+        for m in msgs:
+            msg = MIMEMultipart('alternative')
+            msg['Subject'] = m['assunto']
+            msg['From']    = EMAIL_CONFIG['email']
+            msg['To']      = m['destinatario']
+            msg.attach(MIMEText(m['html'], 'html'))
+            try:
+                self._sessao_smtp().send_message(msg)
+                enviados.append(m['id'])
+            except Exception as e:
+                print(f'[EMAIL] Erro: {e}')
+                falhas.append((m, str(e)[:500]))
+                self._fechar_smtp()
+
+        with transaction() as tx:
+            if enviados:
+                placeholders = ','.join(['%s'] * len(enviados))
+                tx.query(
+                    f"""UPDATE email_fila
+                        SET status='enviado', enviado_em=NOW(), tentativas=tentativas+1, ultimo_erro=NULL
+                        WHERE id IN ({placeholders})""",
+                    tuple(enviados), fetch='none'
+                )
+            for m, erro in falhas:
+                tentativas = m['tentativas'] + 1
+                espera = 30 * 2 ** (tentativas - 1)   # 30s, 1min, 2min, 4min...
+                tx.query(
+                    """UPDATE email_fila
+                       SET status=%s, tentativas=%s, ultimo_erro=%s,
+                           proxima_tentativa = NOW() + INTERVAL %s SECOND
+                       WHERE id=%s""",
+                    ('falhou' if tentativas >= EMAIL_MAX_TENTATIVAS else 'pendente',
+                     tentativas, erro, espera, m['id']),
+                    fetch='none'
+                )
+        self._stats['enviados'] += len(enviados)
+        self._stats['falhas']   += len(falhas)
+        return len(msgs)
+
+    def stats(self):
+        return dict(self._stats, sessao_aberta=self._smtp is not None)
+
+
+REMETENTE = RemetenteEmail()
+
+
+@app.before_request
+def iniciar_tarefas_de_fundo():
+    # Também drena mensagens deixadas na fila antes de um restart
+    REMETENTE.garantir_ativo()
+
+
 def enviar_email(destinatario, assunto, html):
+    """Coloca a mensagem na fila (email_fila); o envio acontece em segundo plano."""
     try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = assunto
-        msg['From']    = EMAIL_CONFIG['email']
-        msg['To']      = destinatario
-        msg.attach(MIMEText(html, 'html'))
-        srv = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-        srv.starttls()
-        srv.login(EMAIL_CONFIG['email'], EMAIL_CONFIG['senha'])
-        srv.send_message(msg)
-        srv.quit()
-        return True
+        query(
+            "INSERT INTO email_fila (destinatario, assunto, html) VALUES (%s,%s,%s)",
+            (destinatario, assunto, html), fetch='none'
+        )
     except Exception as e:
-        print(f'[EMAIL] Erro: {e}')
+        print(f'[EMAIL] Erro ao enfileirar: {e}')
         return False
+    REMETENTE.garantir_ativo()
+    REMETENTE.acordar()
+    return True
+
+
+class GravadorAuditoria:
+    """
+    Buffer em memória para log_atividades. A requisição só faz um append;
+    uma thread por worker grava os eventos em INSERTs multi-linha quando o
+    buffer enche ou a cada LOG_INTERVALO segundos, e o que restar é gravado
+    na saída do processo. Se o banco estiver fora, o lote é descartado e
+    contabilizado — a auditoria nunca derruba a requisição.
+    """
+
+    def __init__(self):
+        self._pid    = None
+        self._lock   = threading.Lock()
+        self._buffer = []
+        self._cheio  = threading.Event()
+        self._stats  = {'gravados': 0, 'descartados': 0, 'lotes': 0, 'erros': 0}
+
+    def garantir_ativo(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid    = os.getpid()
+            self._buffer = []
+            threading.Thread(target=self._loop, name='auditoria', daemon=True).start()
+
+    def registrar(self, usuario_id, acao, descricao, ip):
+        self.garantir_ativo()
+        with self._lock:
+            if len(self._buffer) >= LOG_MAX_BUFFER:
+                self._stats['descartados'] += 1
+                return
+            self._buffer.append((usuario_id, acao, descricao, ip, datetime.now()))
+            cheio = len(self._buffer) >= LOG_LOTE
+        if cheio:
+            self._cheio.set()
+
+    def _loop(self):
+        while True:
+            self._cheio.wait(LOG_INTERVALO)
+            self._cheio.clear()
+            self.gravar()
+
+    def gravar(self):
+        with self._lock:
+            lote, self._buffer = self._buffer, []
+        if not lote:
+            return
+        try:
+            with get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        """INSERT INTO log_atividades (usuario_id, acao, descricao, ip, criado_em)
+                           VALUES (%s,%s,%s,%s,%s)""",
+                        lote
+                    )
+        except Exception as e:
+            print(f'[LOG] {len(lote)} evento(s) descartado(s): {e}')
+            with self._lock:
+                self._stats['descartados'] += len(lote)
+                self._stats['erros'] += 1
+            return
+        with self._lock:
+            self._stats['gravados'] += len(lote)
+            self._stats['lotes'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, no_buffer=len(self._buffer))
+
+
+AUDITORIA = GravadorAuditoria()
+atexit.register(AUDITORIA.gravar)
 
 
 def log(usuario_id, acao, descricao='', ip=None):
-    try:
-        query(
-            "INSERT INTO log_atividades (usuario_id, acao, descricao, ip) VALUES (%s,%s,%s,%s)",
-            (usuario_id, acao, descricao, ip), fetch='none'
-        )
-    except Exception:
-        pass
+    AUDITORIA.registrar(usuario_id, acao, descricao, ip)
 
 # ============================================================
 #  ARQUIVOS ESTÁTICOS
@@ -212,49 +988,192 @@ def log(usuario_id, acao, descricao='', ip=None):
 
 @app.route('/')
 def index():
-    return render_template('index.html', pagina_ativa='home')
+    return PAGINAS_RENDERIZADAS.renderizar('index.html', pagina_ativa='home')
 
 @app.route('/produtos')
 def pagina_produtos():
-    return render_template('produtos.html', pagina_ativa='produtos')
+    return PAGINAS_RENDERIZADAS.renderizar('produtos.html', pagina_ativa='produtos')
+
+# Redireciona URLs com .html para as rotas limpas
+REDIRECIONAMENTOS = {
+    'index.html':            '/',
+    'produtos.html':         '/produtos',
+    'cadastro.html':         '/cadastro',
+    'pagamento.html':        '/pagamento',
+    'minha-conta.html':      '/minha-conta',
+    'meus-pedidos.html':     '/meus-pedidos',
+    'lista-desejos.html':    '/lista-desejos',
+    'recuperar-senha.html':  '/recuperar-senha',
+    'admin-produtos.html':   '/admin-produtos',
+    'gestao-financeira.html': '/gestao-financeira',
+    'config-pagamento.html':  '/config-pagamento',
+}
+
+# Páginas HTML sem extensão → template Jinja (via cache de páginas)
+PAGINAS = {
+    'cadastro':          ('cadastro.html',          'cadastro'),
+    'pagamento':         ('pagamento.html',          'pagamento'),
+    'minha-conta':       ('minha-conta.html',        ''),
+    'meus-pedidos':      ('meus-pedidos.html',       ''),
+    'lista-desejos':     ('lista-desejos.html',      ''),
+    'recuperar-senha':   ('recuperar-senha.html',    ''),
+    'admin-produtos':    ('admin-produtos.html',     ''),
+    'gestao-financeira': ('gestao-financeira.html',  ''),
+    'config-pagamento':  ('config-pagamento.html',   ''),
+}
+
+# Nome carimbado pelo build: style.<10 hex>.css
+_ASSET_CARIMBADO = re.compile(r'^assets/dist/.+\.[0-9a-f]{10}\.(css|js)$')
+
+
+class ManifestoAssets:
+    """
+    Mapa 'css/style.css' → 'dist/css/style.<hash>.css' gravado pelo
+    build_assets.py e relido quando o arquivo muda. Sem build, asset()
+    devolve o caminho original e as páginas funcionam como antes.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._mtime  = None
+        self._mapa   = {}
+
+    def _atualizar(self):
+        try:
+            mtime = os.stat(self.caminho).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        mapa = {}
+        if mtime is not None:
+            try:
+                with open(self.caminho, encoding='utf-8') as f:
+                    mapa = json.load(f)
+            except (OSError, ValueError):
+                pass
+        self._mapa, self._mtime = mapa, mtime
+
+    def url(self, caminho):
+        self._atualizar()
+        return '/assets/' + self._mapa.get(caminho, caminho)
+
+    def versao(self):
+        """mtime do manifesto (None sem build) — entra na chave das páginas."""
+        self._atualizar()
+        return self._mtime
+
+
+ASSETS = ManifestoAssets(ASSETS_MANIFESTO)
+app.jinja_env.globals['asset'] = ASSETS.url   # {{ asset('css/style.css') }}
+
+
+# Bytecode compilado dos templates em disco: workers frios não recompilam
+# base.html e as páginas filhas
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+
+class CachePaginas:
+    """
+    HTML já renderizado das páginas Jinja, chaveado por template e contexto
+    (pagina_ativa, ano do footer, versão do manifesto de assets), guardado
+    junto com as versões gzip/br e o ETag. Zerado quando algum arquivo de
+    templates/ muda — e, por viver na memória, a cada deploy.
+    """
+
+    def __init__(self, pasta):
+        self.pasta    = pasta
+        self._lock    = threading.Lock()
+        self._paginas = {}
+        self._mtime   = None
+        self._checado = 0.0
+        self._stats   = {'hits': 0, 'misses': 0, 'invalidacoes': 0}
+
+    def _conferir_templates(self):
+        agora = time.monotonic()
+        if agora - self._checado < PAGINA_CACHE_CHECAGEM:
+            return
+        self._checado = agora
+        mtime = max((os.stat(os.path.join(self.pasta, nome)).st_mtime
+                     for nome in os.listdir(self.pasta)), default=0)
+        if mtime != self._mtime:
+            with self._lock:
+                if self._mtime is not None:
+                    self._stats['invalidacoes'] += 1
+                self._paginas, self._mtime = {}, mtime
+
+    def renderizar(self, template, **contexto):
+        self._conferir_templates()
+        chave = (template, datetime.now().year, ASSETS.versao(),
+                 tuple(sorted(contexto.items())))
+        pagina = self._paginas.get(chave)
+        if pagina is None:
+            html = render_template(template, **contexto).encode('utf-8')
+            pagina = {
+                'identity': html,
+                'gzip':     gzip.compress(html, compresslevel=9, mtime=0),
+                'etag':     hashlib.sha1(html).hexdigest(),
+            }
+            if brotli:
+                pagina['br'] = brotli.compress(html, quality=11)
+            with self._lock:
+                self._paginas[chave] = pagina
+                self._stats['misses'] += 1
+        else:
+            self._stats['hits'] += 1
+        return self._responder(pagina)
+
+    def _responder(self, pagina):
+        codificacao = next((c for c in ('br', 'gzip')
+                            if c in pagina and request.accept_encodings.quality(c)),
+                           'identity')
+        resp = make_response(pagina[codificacao])
+        resp.mimetype = 'text/html'
+        if codificacao != 'identity':
+            resp.headers['Content-Encoding'] = codificacao
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = 'no-cache'   # sempre revalida pelo ETag
+        resp.set_etag(f"{pagina['etag']}-{codificacao}")
+        return resp.make_conditional(request)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, paginas=len(self._paginas))
+
+
+PAGINAS_RENDERIZADAS = CachePaginas(os.path.join(app.root_path, app.template_folder))
+
+
+def servir_asset_carimbado(path):
+    """
+    Entrega a variante .br/.gz gerada no build conforme o Accept-Encoding,
+    com cache imutável (o nome muda sempre que o conteúdo muda).
+    """
+    for codificacao, ext in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings.quality(codificacao) and os.path.isfile(path + ext):
+            resp = send_from_directory('.', path + ext,
+                                       mimetype=mimetypes.guess_type(path)[0])
+            resp.headers['Content-Encoding'] = codificacao
+            break
+    else:
+        resp = send_from_directory('.', path)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = CACHE_CONTROL_IMUTAVEL
+    return resp
+
 
 @app.route('/<path:path>')
 def serve_static(path):
-    import os
-
-    # Redireciona URLs com .html para as rotas limpas
-    redirecionamentos = {
-        'index.html':            '/',
-        'produtos.html':         '/produtos',
-        'cadastro.html':         '/cadastro',
-        'pagamento.html':        '/pagamento',
-        'minha-conta.html':      '/minha-conta',
-        'meus-pedidos.html':     '/meus-pedidos',
-        'lista-desejos.html':    '/lista-desejos',
-        'recuperar-senha.html':  '/recuperar-senha',
-        'admin-produtos.html':   '/admin-produtos',
-        'gestao-financeira.html': '/gestao-financeira',
-        'config-pagamento.html':  '/config-pagamento',
-    }
-    if path in redirecionamentos:
-        from flask import redirect
-        return redirect(redirecionamentos[path], code=301)
-
-    # Páginas HTML sem extensão → render_template
-    paginas = {
-        'cadastro':          ('cadastro.html',          'cadastro'),
-        'pagamento':         ('pagamento.html',          'pagamento'),
-        'minha-conta':       ('minha-conta.html',        ''),
-        'meus-pedidos':      ('meus-pedidos.html',       ''),
-        'lista-desejos':     ('lista-desejos.html',      ''),
-        'recuperar-senha':   ('recuperar-senha.html',    ''),
-        'admin-produtos':    ('admin-produtos.html',     ''),
-        'gestao-financeira': ('gestao-financeira.html',  ''),
-        'config-pagamento':  ('config-pagamento.html',   ''),
-    }
-    if path in paginas:
-        tpl, pagina = paginas[path]
-        return render_template(tpl, pagina_ativa=pagina)
+    if path in REDIRECIONAMENTOS:
+        return redirect(REDIRECIONAMENTOS[path], code=301)
+
+    if path in PAGINAS:
+        tpl, pagina = PAGINAS[path]
+        return PAGINAS_RENDERIZADAS.renderizar(tpl, pagina_ativa=pagina)
+
+    if _ASSET_CARIMBADO.match(path):
+        return servir_asset_carimbado(path)
 
     # Arquivos estáticos (CSS, JS, imagens, vídeos, etc.)
     return send_from_directory('.', path)
@@ -266,9 +1185,8 @@ def serve_static(path):
 @app.route('/api/status')
 def status():
     try:
-        conn = get_db()
-        conn.ping(reconnect=True)
-        conn.close()
+        with get_db() as conn:
+            conn.ping(reconnect=True)
         db_ok = True
     except Exception:
         db_ok = False
@@ -300,7 +1218,7 @@ def cadastro():
     if existe:
         return err('Este e-mail já está cadastrado')
 
-    hash_senha = generate_password_hash(senha)
+    hash_senha = SENHAS.gerar(senha)
     _, novo_id = query(
         """INSERT INTO usuarios
            (nome, sobrenome, email, senha_hash, telefone, cpf, genero, aceita_news)
@@ -326,6 +1244,10 @@ def login():
     if not email or not senha:
         return err('Informe e-mail e senha')
 
+    bloqueio = limitar((LOGIN_POR_IP, request.remote_addr), (LOGIN_POR_EMAIL, email))
+    if bloqueio:
+        return bloqueio
+
     user, _ = query(
         "SELECT id, nome, sobrenome, senha_hash, tipo, ativo FROM usuarios WHERE email=%s",
         (email,), fetch='one'
@@ -334,8 +1256,10 @@ def login():
         return err('E-mail ou senha incorretos', 401)
     if not user['ativo']:
         return err('Conta desativada. Entre em contato com o suporte.', 403)
-    if not check_password_hash(user['senha_hash'], senha):
+    if not SENHAS.verificar(user['senha_hash'], senha):
         return err('E-mail ou senha incorretos', 401)
+    if SENHAS.precisa_rehash(user['senha_hash']):
+        SENHAS.rehash_em_segundo_plano(user['id'], user['senha_hash'], senha)
 
     token = gerar_token(user['id'], user['tipo'])
     log(user['id'], 'login', f'Login via API — IP: {request.remote_addr}')
@@ -357,6 +1281,11 @@ def recuperar_senha():
     if not email:
         return err('Informe o e-mail')
 
+    bloqueio = limitar((RECUPERACAO_POR_IP, request.remote_addr),
+                       (RECUPERACAO_POR_EMAIL, email))
+    if bloqueio:
+        return bloqueio
+
     user, _ = query("SELECT id, nome FROM usuarios WHERE email=%s AND ativo=1",
                     (email,), fetch='one')
     # Retorna ok mesmo se não existir (não expõe se o e-mail está cadastrado)
@@ -413,11 +1342,12 @@ def redefinir_senha():
     if not rec:
         return err('Link inválido ou expirado. Solicite um novo.', 400)
 
-    hash_nova = generate_password_hash(nova_senha)
-    query("UPDATE usuarios SET senha_hash=%s WHERE id=%s",
-          (hash_nova, rec['usuario_id']), fetch='none')
-    query("UPDATE recuperacao_senha SET usado=1 WHERE id=%s",
-          (rec['id'],), fetch='none')
+    hash_nova = SENHAS.gerar(nova_senha)
+    with transaction() as tx:
+        tx.query("UPDATE usuarios SET senha_hash=%s WHERE id=%s",
+                 (hash_nova, rec['usuario_id']), fetch='none')
+        tx.query("UPDATE recuperacao_senha SET usado=1 WHERE id=%s",
+                 (rec['id'],), fetch='none')
     log(rec['usuario_id'], 'redefinir_senha')
     return ok(msg='Senha redefinida com sucesso!')
 
@@ -489,11 +1419,11 @@ def alterar_senha():
 
     user, _ = query("SELECT senha_hash FROM usuarios WHERE id=%s",
                     (request.usuario_id,), fetch='one')
-    if not check_password_hash(user['senha_hash'], senha_atual):
+    if not SENHAS.verificar(user['senha_hash'], senha_atual):
         return err('Senha atual incorreta', 401)
 
     query("UPDATE usuarios SET senha_hash=%s WHERE id=%s",
-          (generate_password_hash(nova_senha), request.usuario_id), fetch='none')
+          (SENHAS.gerar(nova_senha), request.usuario_id), fetch='none')
     log(request.usuario_id, 'alterar_senha')
     return ok(msg='Senha alterada com sucesso!')
 
@@ -518,20 +1448,21 @@ def criar_endereco():
         if not d.get(c):
             return err(f'Campo obrigatório: {c}')
 
-    if d.get('padrao'):
-        query("UPDATE enderecos SET padrao=0 WHERE usuario_id=%s",
-              (request.usuario_id,), fetch='none')
-
-    _, eid = query(
-        """INSERT INTO enderecos
-           (usuario_id, apelido, cep, logradouro, numero, complemento, bairro, cidade, estado, padrao)
-           VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
-        (request.usuario_id, d.get('apelido','Casa'),
-         d['cep'], d['logradouro'], d['numero'],
-         d.get('complemento'), d['bairro'], d['cidade'], d['estado'],
-         1 if d.get('padrao') else 0),
-        fetch='none'
-    )
+    with transaction() as tx:
+        if d.get('padrao'):
+            tx.query("UPDATE enderecos SET padrao=0 WHERE usuario_id=%s",
+                     (request.usuario_id,), fetch='none')
+
+        _, eid = tx.query(
+            """INSERT INTO enderecos
+               (usuario_id, apelido, cep, logradouro, numero, complemento, bairro, cidade, estado, padrao)
+               VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
+            (request.usuario_id, d.get('apelido','Casa'),
+             d['cep'], d['logradouro'], d['numero'],
+             d.get('complemento'), d['bairro'], d['cidade'], d['estado'],
+             1 if d.get('padrao') else 0),
+            fetch='none'
+        )
     return ok({'id': eid}, 'Endereço adicionado!', 201)
 
 
@@ -542,6 +1473,398 @@ def deletar_endereco(eid):
           (eid, request.usuario_id), fetch='none')
     return ok(msg='Endereço removido.')
 
+# ============================================================
+#  CACHE DO CATÁLOGO (por worker)
+# ============================================================
+
+CATALOGO_TTL = int(os.environ.get('CATALOGO_TTL', 60))  # segundos
+
+
+class CacheCatalogo:
+    """
+    Cache read-through do catálogo ativo (produtos, categorias e sabores).
+    Recarregado no primeiro acesso após invalidar() ou após `ttl` segundos
+    — o TTL cobre as escritas feitas por outros workers.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._dados = None
+        self._carregado_em = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'invalidacoes': 0}
+
+    def _valido(self, dados, carregado_em):
+        return dados is not None and time.monotonic() - carregado_em < self.ttl
+
+    def obter(self):
+        dados, carregado_em = self._dados, self._carregado_em
+        if self._valido(dados, carregado_em):
+            self._stats['hits'] += 1
+            return dados
+        with self._lock:
+            if self._valido(self._dados, self._carregado_em):
+                self._stats['hits'] += 1
+                return self._dados
+            self._stats['misses'] += 1
+            self._dados = self._carregar()
+            self._carregado_em = time.monotonic()
+            return self._dados
+
+    def _carregar(self):
+        produtos, _ = query(
+            """SELECT p.*, c.nome AS categoria_nome, c.slug AS categoria_slug
+               FROM produtos p
+               LEFT JOIN categorias c ON c.id = p.categoria_id
+               WHERE p.ativo = 1
+               ORDER BY p.destaque DESC, p.id"""
+        )
+        categorias, _ = query("SELECT * FROM categorias WHERE ativa=1 ORDER BY ordem, nome")
+        produtos = list(produtos or [])
+        # Converte Decimal para float uma única vez
+        for r in produtos:
+            r['preco'] = float(r['preco'])
+            if r.get('preco_promocional'):
+                r['preco_promocional'] = float(r['preco_promocional'])
+            r['nota_media'] = float(r['nota_media'])
+            r['histograma_notas'] = [r.pop(f'avaliacoes_{n}') for n in range(1, 6)]
+            r['imagem_srcset'] = VARIANTES.srcset(r.get('imagem_principal'))
+        categorias = list(categorias or [])
+        # Sabores ativos de todos os produtos numa única consulta
+        sabores, _ = query(
+            """SELECT id, produto_id, nome, descricao, preco_adicional, estoque, peso_gramas, ordem
+               FROM produto_sabores
+               WHERE ativo = 1
+               ORDER BY produto_id, ordem, id"""
+        )
+        sabores = list(sabores or [])
+        sabores_por_produto = {}
+        for s in sabores:
+            s['preco_adicional'] = float(s['preco_adicional'])
+            sabores_por_produto.setdefault(s['produto_id'], []).append(s)
+        # Carimbo de versão: hash do conteúdo, igual em todos os workers
+        versao = hashlib.sha1(
+            json.dumps([produtos, categorias, sabores], default=str, sort_keys=True).encode()
+        ).hexdigest()
+        return {
+            'produtos':            produtos,
+            'por_id':              {r['id']: r for r in produtos},
+            'categorias':          categorias,
+            'sabores':             {s['id']: s for s in sabores},
+            'sabores_por_produto': sabores_por_produto,
+            'versao':              versao,
+        }
+
+    def invalidar(self):
+        with self._lock:
+            self._dados = None
+            self._stats['invalidacoes'] += 1
+
+    def stats(self):
+        dados = dict(self._stats)
+        dados['carregado'] = self._dados is not None
+        dados['produtos']  = len(self._dados['produtos']) if self._dados else 0
+        return dados
+
+
+CATALOGO = CacheCatalogo(CATALOGO_TTL)
+
+# ============================================================
+#  BUSCA DE PRODUTOS (índice invertido em memória)
+# ============================================================
+
+BUSCA_TTL = int(os.environ.get('BUSCA_TTL', 600))  # reconstrução completa (s)
+
+# Peso de cada campo no ranking
+BUSCA_PESOS = {'nome': 3.0, 'sabores': 2.0, 'descricao_curta': 1.5, 'descricao': 1.0}
+
+BUSCA_STOPWORDS = {
+    'a', 'o', 'as', 'os', 'e', 'de', 'da', 'do', 'das', 'dos', 'com', 'sem',
+    'em', 'no', 'na', 'nos', 'nas', 'ao', 'aos', 'um', 'uma', 'para', 'por', 'que',
+}
+
+# Sufixos removidos pelo stemmer (mais longos primeiro)
+_SUFIXOS_PLURAL = (('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'),
+                   ('ois', 'ol'), ('ns', 'm'), ('res', 'r'), ('is', 'il'), ('s', ''))
+_SUFIXOS_GRAU   = ('zinho', 'zinha', 'inho', 'inha', 'issimo', 'issima')
+_SUFIXOS_NOME   = ('mente', 'idade', 'mento', 'ismo', 'ista', 'ador', 'adora',
+                   'ante', 'avel', 'ivel', 'oso', 'osa')
+
+
+def normalizar_texto(texto):
+    """Minúsculas e sem acentos: 'Avelã' → 'avela'."""
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def stem_pt(palavra):
+    """Stemmer leve para português (plural, grau, gênero e sufixos comuns)."""
+    if len(palavra) <= 3:
+        return palavra
+    for suf, troca in _SUFIXOS_PLURAL:
+        if palavra.endswith(suf) and len(palavra) - len(suf) >= 3:
+            palavra = palavra[:-len(suf)] + troca
+            break
+    for suf in _SUFIXOS_GRAU + _SUFIXOS_NOME:
+        if palavra.endswith(suf) and len(palavra) - len(suf) >= 3:
+            palavra = palavra[:-len(suf)]
+            break
+    # Gênero / vogal temática: 'amarga', 'amargo' → 'amarg'
+    if len(palavra) > 4 and palavra[-1] in 'aoe':
+        palavra = palavra[:-1]
+    return palavra
+
+
+def tokenizar(texto):
+    termos = []
+    palavra = []
+    for c in normalizar_texto(texto) + ' ':
+        if c.isalnum():
+            palavra.append(c)
+        elif palavra:
+            p = ''.join(palavra)
+            palavra = []
+            if p not in BUSCA_STOPWORDS:
+                termos.append(stem_pt(p))
+    return termos
+
+
+class IndiceBusca:
+    """
+    Índice invertido dos produtos ativos: nome, descrições e nomes dos
+    sabores, com acentos removidos e termos reduzidos ao radical.
+    Atualizado produto a produto nas escritas do admin; o TTL reconstrói
+    tudo para pegar escritas feitas em outros workers.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.geracao = 0
+        self._lock = threading.RLock()
+        self._docs = {}        # produto_id → {termo: peso}
+        self._postings = {}    # termo → {produto_id: peso}
+        self._construido_em = None
+
+    def _indexar(self, pid, campos):
+        self._remover(pid)
+        pesos = {}
+        for campo, texto in campos.items():
+            for termo in tokenizar(texto):
+                pesos[termo] = pesos.get(termo, 0.0) + BUSCA_PESOS[campo]
+        self._docs[pid] = pesos
+        for termo, peso in pesos.items():
+            self._postings.setdefault(termo, {})[pid] = peso
+
+    def _remover(self, pid):
+        for termo in self._docs.pop(pid, {}):
+            docs = self._postings.get(termo)
+            if docs is not None:
+                docs.pop(pid, None)
+                if not docs:
+                    del self._postings[termo]
+
+    def _campos(self, produtos, sabores):
+        por_produto = {}
+        for s in (sabores or []):
+            por_produto.setdefault(s['produto_id'], []).append(s['nome'])
+        for p in (produtos or []):
+            yield p['id'], {
+                'nome':            p['nome'],
+                'descricao_curta': p['descricao_curta'],
+                'descricao':       p['descricao'],
+                'sabores':         ' '.join(por_produto.get(p['id'], [])),
+            }
+
+    def reconstruir(self):
+        produtos, _ = query(
+            "SELECT id, nome, descricao_curta, descricao FROM produtos WHERE ativo=1")
+        sabores, _ = query(
+            "SELECT produto_id, nome FROM produto_sabores WHERE ativo=1")
+        with self._lock:
+            self._docs, self._postings = {}, {}
+            for pid, campos in self._campos(produtos, sabores):
+                self._indexar(pid, campos)
+            self._construido_em = time.monotonic()
+            self.geracao += 1
+
+    def atualizar_produto(self, pid):
+        """Reindexa um único produto (ou o remove, se inativo)."""
+        with self._lock:
+            if self._construido_em is None:
+                return   # ainda não construído: a 1ª busca monta tudo
+        prod, _ = query(
+            "SELECT id, nome, descricao_curta, descricao FROM produtos WHERE id=%s AND ativo=1",
+            (pid,), fetch='one')
+        sabores, _ = query(
+            "SELECT produto_id, nome FROM produto_sabores WHERE produto_id=%s AND ativo=1",
+            (pid,))
+        with self._lock:
+            if prod:
+                for _pid, campos in self._campos([prod], sabores):
+                    self._indexar(_pid, campos)
+            else:
+                self._remover(pid)
+            self.geracao += 1
+
+    def buscar(self, texto):
+        """
+        Retorna [(produto_id, score)] em ordem de relevância.
+        Todos os termos precisam casar; o último também casa por prefixo
+        (busca enquanto digita), com peso menor.
+        """
+        termos = tokenizar(texto)
+        if not termos:
+            return []
+        with self._lock:
+            if self._construido_em is None or time.monotonic() - self._construido_em > self.ttl:
+                self.reconstruir()
+            total_docs = len(self._docs) or 1
+            scores = None
+            for i, termo in enumerate(termos):
+                candidatos = {termo: 1.0} if termo in self._postings else {}
+                if i == len(termos) - 1:
+                    for t in self._postings:
+                        if t != termo and t.startswith(termo):
+                            candidatos[t] = 0.5
+                parcial = {}
+                for t, fator in candidatos.items():
+                    docs = self._postings[t]
+                    idf = 1.0 + (total_docs / len(docs)) ** 0.5
+                    for pid, peso in docs.items():
+                        parcial[pid] = parcial.get(pid, 0.0) + fator * peso * idf
+                if scores is None:
+                    scores = parcial
+                else:
+                    scores = {pid: sc + parcial[pid] for pid, sc in scores.items() if pid in parcial}
+                if not scores:
+                    return []
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+    def stats(self):
+        with self._lock:
+            return {'produtos': len(self._docs), 'termos': len(self._postings),
+                    'geracao': self.geracao}
+
+
+BUSCA = IndiceBusca(BUSCA_TTL)
+
+# ============================================================
+#  CACHE DE CONFIGURAÇÕES (por worker)
+# ============================================================
+
+CONFIG_TTL      = int(os.environ.get('CONFIG_TTL', 300))  # rede de segurança (s)
+CONFIG_CHECAGEM = 1   # segundos entre conferências do carimbo de versão
+CONFIG_CARIMBO  = os.environ.get('CONFIG_CARIMBO',
+                                 os.path.join(tempfile.gettempdir(), 'spinassi-config.versao'))
+
+# Conversão das chaves usadas pelo código: (tipo, padrão)
+CONFIG_TIPOS = {
+    'frete_padrao':       (float, 15.00),
+    'frete_gratis_acima': (float, 150.00),
+    'santander_ativo':    (bool,  False),
+    'boleto_ativo':       (bool,  False),
+    'cartao_ativo':       (bool,  False),
+}
+
+
+def _converter_config(tipo, valor, padrao):
+    if valor is None or valor == '':
+        return padrao
+    if tipo is bool:
+        return str(valor).strip().lower() in ('1', 'true', 'sim', 'on')
+    try:
+        return tipo(valor)
+    except (TypeError, ValueError):
+        return padrao
+
+
+class CacheConfiguracoes:
+    """
+    Tabela configuracoes inteira em memória, carregada num único SELECT.
+    obter() devolve os valores tipados (CONFIG_TIPOS), brutos() as strings
+    como estão no banco. invalidar() recarrega no próximo acesso e toca
+    o arquivo CONFIG_CARIMBO: os outros workers da máquina comparam o mtime
+    dele (no máximo a cada CONFIG_CHECAGEM s, só um stat) e recarregam
+    também. Entre máquinas diferentes vale o CONFIG_TTL.
+    """
+
+    def __init__(self, ttl, carimbo):
+        self.ttl     = ttl
+        self.carimbo = carimbo
+        self._lock   = threading.Lock()
+        self._dados  = None
+        self._carregado_em = 0.0
+        self._checado      = 0.0
+        self._versao_vista = None
+        self._stats = {'hits': 0, 'misses': 0, 'invalidacoes': 0}
+
+    def _versao_externa(self):
+        try:
+            return os.stat(self.carimbo).st_mtime_ns
+        except OSError:
+            return None
+
+    def _conferir(self, dados):
+        agora = time.monotonic()
+        if dados is None or agora - self._carregado_em >= self.ttl:
+            return False
+        if agora - self._checado >= CONFIG_CHECAGEM:
+            if self._versao_externa() != self._versao_vista:
+                return False
+            self._checado = agora
+        return True
+
+    def _obter(self):
+        dados = self._dados
+        if self._conferir(dados):
+            self._stats['hits'] += 1
+            return dados
+        with self._lock:
+            if self._conferir(self._dados):
+                self._stats['hits'] += 1
+                return self._dados
+            self._stats['misses'] += 1
+            versao_externa = self._versao_externa()
+            rows, _ = query("SELECT chave, valor FROM configuracoes")
+            brutos = {r['chave']: r['valor'] for r in (rows or [])}
+            tipados = dict(brutos)
+            for chave, (tipo, padrao) in CONFIG_TIPOS.items():
+                tipados[chave] = _converter_config(tipo, brutos.get(chave), padrao)
+            self._dados = {
+                'brutos':  brutos,
+                'tipados': tipados,
+                'versao':  hashlib.sha1(json.dumps(brutos, sort_keys=True).encode()).hexdigest(),
+            }
+            self._versao_vista = versao_externa
+            self._carregado_em = self._checado = time.monotonic()
+            return self._dados
+
+    def obter(self):
+        return self._obter()['tipados']
+
+    def brutos(self):
+        return self._obter()['brutos']
+
+    def versao(self):
+        return self._obter()['versao']
+
+    def invalidar(self):
+        with self._lock:
+            self._dados = None
+            self._stats['invalidacoes'] += 1
+        try:
+            with open(self.carimbo, 'w') as f:
+                f.write(str(time.time_ns()))
+        except OSError as e:
+            print(f'[CONFIG] Não foi possível atualizar o carimbo {self.carimbo}: {e}')
+
+    def stats(self):
+        return dict(self._stats, carregado=self._dados is not None,
+                    chaves=len(self._dados['brutos']) if self._dados else 0)
+
+
+CONFIG = CacheConfiguracoes(CONFIG_TTL, CONFIG_CARIMBO)
+
 # ============================================================
 #  CATEGORIAS
 # ============================================================
@@ -549,10 +1872,10 @@ def deletar_endereco(eid):
 @app.route('/api/categorias', methods=['GET'])
 def listar_categorias():
     try:
-        rows, _ = query("SELECT * FROM categorias WHERE ativa=1 ORDER BY ordem, nome")
-        return ok(rows)
+        cat = CATALOGO.obter()
     except Exception:
         return ok([])
+    return ok_cacheavel(cat['categorias'], cat['versao'])
 
 # ============================================================
 #  PRODUTOS (público)
@@ -563,80 +1886,162 @@ def listar_produtos():
     categoria = request.args.get('categoria')
     busca     = request.args.get('q', '')
     destaque  = request.args.get('destaque')
-    limite    = min(int(request.args.get('limite', 100)), 200)
-    offset    = int(request.args.get('offset', 0))
+    ordem     = request.args.get('ordem')        # 'avaliacao' → melhor nota primeiro
+    nota_min  = request.args.get('nota_min', type=float)
+    limite    = limite_pagina(100, 200)
+    offset    = max(0, request.args.get('offset', 0, type=int))
+    after     = request.args.get('after')
 
-    where  = ['p.ativo = 1']
-    params = []
+    try:
+        cat = CATALOGO.obter()
+        if busca:
+            ranking = BUSCA.buscar(busca)
+    except Exception:
+        return ok([])
 
-    if categoria:
-        where.append('c.slug = %s')
-        params.append(categoria)
+    # Filtros e paginação respondidos direto da memória.
+    # Chave de ordenação: (destaque DESC, id), na busca (score DESC, id) e
+    # com ordem=avaliacao (nota_media DESC, total_avaliacoes DESC, id);
+    # o cursor carrega a própria chave do último item
     if busca:
-        where.append('(p.nome LIKE %s OR p.descricao_curta LIKE %s)')
-        params += [f'%{busca}%', f'%{busca}%']
+        por_id = cat['por_id']
+        score  = dict(ranking)
+        rows = [por_id[pid] for pid, _ in ranking if pid in por_id]
+        chave = lambda r: (-score[r['id']], r['id'])
+        versao = f"{cat['versao']}:{BUSCA.geracao}"
+    else:
+        rows = cat['produtos']
+        chave = lambda r: (-r['destaque'], r['id'])
+        versao = cat['versao']
+    if ordem == 'avaliacao':
+        chave = lambda r: (-r['nota_media'], -r['total_avaliacoes'], r['id'])
+        rows = sorted(rows, key=chave)
+    if categoria:
+        rows = [r for r in rows if r['categoria_slug'] == categoria]
     if destaque:
-        where.append('p.destaque = 1')
-
-    sql = f"""
-        SELECT p.*, c.nome AS categoria_nome, c.slug AS categoria_slug
-        FROM produtos p
-        LEFT JOIN categorias c ON c.id = p.categoria_id
-        WHERE {' AND '.join(where)}
-        ORDER BY p.destaque DESC, p.id
-        LIMIT %s OFFSET %s
+        rows = [r for r in rows if r['destaque']]
+    if nota_min:
+        rows = [r for r in rows if r['nota_media'] >= nota_min]
+
+    if after:
+        try:
+            ultimo = tuple(cursor_decodificar(after, tamanho=3 if ordem == 'avaliacao' else 2))
+        except ValueError as e:
+            return err(str(e))
+        rows = [r for r in rows if chave(r) > ultimo]
+        offset = 0
+    pagina = rows[offset:offset + limite]
+    proximo = None
+    if pagina and len(rows) > offset + limite:
+        proximo = cursor_codificar(*chave(pagina[-1]))
+    return ok_cacheavel(pagina, versao, proximo=proximo)
+
+
+AVALIACOES_POR_PAGINA = 10
+
+# Imagens e 1ª página de avaliações numa única consulta
+# (JSON_ARRAYAGG). A ordem dentro do agregado não é garantida — quem
+# ordena é o Python; o LIMIT da página usa idx_produto_aprovada.
+SQL_DETALHE_PRODUTO = """
+SELECT
+  (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+            'id', id, 'produto_id', produto_id, 'url', url,
+            'alt_text', alt_text, 'ordem', ordem))
+     FROM produto_imagens WHERE produto_id = %s)                      AS imagens,
+  (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+            'id', av.id, 'produto_id', av.produto_id, 'usuario_id', av.usuario_id,
+            'nome', av.nome, 'nota', av.nota, 'comentario', av.comentario,
+            'aprovada', av.aprovada, 'criado_em', av.criado_em,
+            'nome_usuario', av.nome_usuario))
+     FROM (SELECT a.id, a.produto_id, a.usuario_id, a.nome, a.nota, a.comentario,
+                  a.aprovada, DATE_FORMAT(a.criado_em, '%%Y-%%m-%%d %%H:%%i:%%s') AS criado_em,
+                  u.nome AS nome_usuario
+           FROM avaliacoes a
+           LEFT JOIN usuarios u ON u.id = a.usuario_id
+           WHERE a.produto_id = %s AND a.aprovada = 1
+           ORDER BY a.criado_em DESC, a.id DESC
+           LIMIT %s) av)                                              AS avaliacoes
+"""
+
+
+SABORES_MAX_IDS = 100
+
+
+@app.route('/api/produtos/sabores', methods=['GET'])
+def listar_sabores():
+    """
+    Sabores ativos de vários produtos de uma vez (?ids=1,2,3), direto do
+    cache do catálogo. Responde {produto_id: [sabores]}; produtos fora do
+    catálogo ficam de fora.
     """
-    params += [limite, offset]
     try:
-        rows, _ = query(sql, params)
-        # Converte Decimal para float
-        for r in (rows or []):
-            r['preco'] = float(r['preco'])
-            if r.get('preco_promocional'):
-                r['preco_promocional'] = float(r['preco_promocional'])
-        return ok(rows)
-    except Exception:
-        return ok([])
+        ids = {int(i) for i in request.args.get('ids', '').split(',') if i.strip()}
+    except ValueError:
+        return err('Parâmetro ids inválido')
+    if not ids or len(ids) > SABORES_MAX_IDS:
+        return err(f'Informe de 1 a {SABORES_MAX_IDS} ids de produto')
+
+    cat = CATALOGO.obter()
+    return ok_cacheavel({pid: cat['sabores_por_produto'].get(pid, [])
+                         for pid in sorted(ids) if pid in cat['por_id']},
+                        cat['versao'])
 
 
 @app.route('/api/produtos/<int:pid>', methods=['GET'])
 def detalhe_produto(pid):
-    prod, _ = query(
-        """SELECT p.*, c.nome AS categoria_nome
-           FROM produtos p
-           LEFT JOIN categorias c ON c.id = p.categoria_id
-           WHERE p.id=%s AND p.ativo=1""",
-        (pid,), fetch='one'
-    )
+    # Produto e sabores vêm do cache do catálogo; o banco só é consultado
+    # uma vez, para imagens e avaliações
+    cat  = CATALOGO.obter()
+    prod = cat['por_id'].get(pid)
     if not prod:
         return err('Produto não encontrado', 404)
-    prod['preco'] = float(prod['preco'])
-    if prod.get('preco_promocional'):
-        prod['preco_promocional'] = float(prod['preco_promocional'])
+    prod = dict(prod)
+
+    row, _ = query(SQL_DETALHE_PRODUTO, (pid, pid, AVALIACOES_POR_PAGINA + 1), fetch='one')
 
-    imagens, _ = query("SELECT * FROM produto_imagens WHERE produto_id=%s ORDER BY ordem", (pid,))
+    imagens = sorted(json.loads(row['imagens'] or '[]'), key=lambda i: (i['ordem'], i['id']))
+    for img in imagens:
+        img['srcset'] = VARIANTES.srcset(img['url'])
     prod['imagens'] = imagens
 
-    avaliacoes, _ = query(
-        """SELECT a.*, u.nome AS nome_usuario
-           FROM avaliacoes a
-           LEFT JOIN usuarios u ON u.id = a.usuario_id
-           WHERE a.produto_id=%s AND a.aprovada=1
-           ORDER BY a.criado_em DESC""",
-        (pid,)
-    )
-    for av in (avaliacoes or []):
-        av['criado_em'] = str(av['criado_em'])
-    prod['avaliacoes'] = avaliacoes
+    prod['sabores'] = cat['sabores_por_produto'].get(pid, [])
+
+    avaliacoes = sorted(json.loads(row['avaliacoes'] or '[]'),
+                        key=lambda av: (av['criado_em'], av['id']), reverse=True)
+    proximo = None
+    if len(avaliacoes) > AVALIACOES_POR_PAGINA:
+        avaliacoes = avaliacoes[:AVALIACOES_POR_PAGINA]
+        proximo = cursor_codificar(avaliacoes[-1]['criado_em'], avaliacoes[-1]['id'])
+    prod['avaliacoes']         = avaliacoes
+    prod['avaliacoes_proximo'] = proximo
 
     prod['criado_em']     = str(prod['criado_em'])
     prod['atualizado_em'] = str(prod['atualizado_em'])
-    return ok(prod)
+    return ok_cacheavel(prod)
 
 # ============================================================
 #  AVALIAÇÕES
 # ============================================================
 
+@app.route('/api/produtos/<int:pid>/avaliacoes', methods=['GET'])
+def listar_avaliacoes(pid):
+    """Mais avaliações aprovadas: continua de ?after= (avaliacoes_proximo do detalhe)."""
+    limite = limite_pagina(AVALIACOES_POR_PAGINA, 50)
+    try:
+        rows, proximo = pagina_keyset(
+            """SELECT a.*, u.nome AS nome_usuario
+               FROM avaliacoes a
+               LEFT JOIN usuarios u ON u.id = a.usuario_id {where}""",
+            ['a.produto_id=%s', 'a.aprovada=1'], [pid],
+            request.args.get('after'), limite, 'a.criado_em', 'a.id'
+        )
+    except ValueError as e:
+        return err(str(e))
+    for r in rows:
+        r['criado_em'] = str(r['criado_em'])
+    return ok_cacheavel(rows, proximo=proximo)
+
+
 @app.route('/api/produtos/<int:pid>/avaliacoes', methods=['POST'])
 def criar_avaliacao(pid):
     d          = request.get_json() or {}
@@ -706,48 +2111,308 @@ def remover_desejo(pid):
 #  CUPONS — validar
 # ============================================================
 
+class CupomRecusado(Exception):
+    """O cupom informado não vale para este carrinho (mensagem para o cliente)."""
+
+
+def aplicar_cupom(consulta, subtotal, codigo=None, cupom_id=None, travar=False):
+    """
+    Regra única de cupom para validar, cotar e fechar o pedido: ativo, dentro
+    da validade, com uso disponível e pedido mínimo atendido pelo `subtotal`
+    calculado no servidor. `consulta` é query() ou tx.query; com travar=True
+    a linha do cupom fica presa (FOR UPDATE) até o COMMIT, para o limite de
+    uso não estourar com pedidos simultâneos.
+    Retorna (cupom, desconto); levanta CupomRecusado.
+    """
+    campo, valor = ('codigo', codigo) if codigo else ('id', cupom_id)
+    cupom, _ = consulta(
+        f"""SELECT * FROM cupons
+            WHERE {campo}=%s AND ativo=1
+              AND (valido_de IS NULL OR valido_de <= NOW())
+              AND (valido_ate IS NULL OR valido_ate >= NOW())
+              AND (limite_uso IS NULL OR total_usado < limite_uso)
+            {'FOR UPDATE' if travar else ''}""",
+        (valor,), fetch='one'
+    )
+    if not cupom:
+        raise CupomRecusado('Cupom inválido ou expirado')
+
+    minimo = float(cupom['valor_minimo_pedido'] or 0)
+    if subtotal < minimo:
+        raise CupomRecusado(f'Pedido mínimo para este cupom: R$ {minimo:.2f}')
+    return cupom, desconto_cupom(cupom, subtotal)
+
+
+def desconto_cupom(cupom, subtotal):
+    """Desconto em reais do cupom sobre o subtotal — mesma regra da cotação e do pedido."""
+    if not cupom:
+        return 0.0
+    v = float(cupom['valor'])
+    return round(subtotal * v / 100, 2) if cupom['tipo'] == 'percentual' else min(v, subtotal)
+
+
+def calcular_frete(base, cfg):
+    """Frete padrão, ou zero quando o valor após o desconto atinge o mínimo de frete grátis."""
+    return 0.0 if base >= cfg['frete_gratis_acima'] else cfg['frete_padrao']
+
+
 @app.route('/api/cupons/validar', methods=['POST'])
 def validar_cupom():
     d       = request.get_json() or {}
     codigo  = (d.get('codigo') or '').strip().upper()
-    total   = float(d.get('total', 0))
 
     if not codigo:
         return err('Informe o código do cupom')
 
-    cupom, _ = query(
-        """SELECT * FROM cupons
-           WHERE codigo=%s AND ativo=1
-             AND (valido_de IS NULL OR valido_de <= NOW())
-             AND (valido_ate IS NULL OR valido_ate >= NOW())
-             AND (limite_uso IS NULL OR total_usado < limite_uso)""",
-        (codigo,), fetch='one'
-    )
-    if not cupom:
-        return err('Cupom inválido ou expirado')
-
-    minimo = float(cupom['valor_minimo_pedido'] or 0)
-    if total < minimo:
-        return err(f'Pedido mínimo para este cupom: R$ {minimo:.2f}')
+    # Subtotal vem do carrinho com os preços do catálogo, nunca de um total do cliente
+    try:
+        linhas = linhas_carrinho(d.get('carrinho', []))
+    except ValueError as e:
+        return err(str(e))
+    subtotal = cotar_carrinho(linhas, None, CONFIG.obter(), CATALOGO.obter())['subtotal']
 
-    valor_cupom = float(cupom['valor'])
-    if cupom['tipo'] == 'percentual':
-        desconto = round(total * valor_cupom / 100, 2)
-    else:
-        desconto = min(valor_cupom, total)
+    try:
+        cupom, desconto = aplicar_cupom(query, subtotal, codigo=codigo)
+    except CupomRecusado as e:
+        return err(str(e))
 
     return ok({
         'id':       cupom['id'],
         'codigo':   cupom['codigo'],
         'tipo':     cupom['tipo'],
-        'valor':    valor_cupom,
+        'valor':    float(cupom['valor']),
+        'subtotal': subtotal,
         'desconto': desconto,
     }, f'Cupom aplicado! Desconto de R$ {desconto:.2f}')
 
+# ============================================================
+#  CARRINHO — cotação
+# ============================================================
+
+COTACAO_MAX_LINHAS = int(os.environ.get('COTACAO_MAX_LINHAS', 100))
+
+
+def linhas_carrinho(carrinho):
+    """
+    Normaliza o carrinho do frontend em [(produto_id, sabor_id, quantidade)].
+    sabor_id é None quando a linha não escolhe sabor. ValueError se inválido.
+    """
+    if not isinstance(carrinho, list) or len(carrinho) > COTACAO_MAX_LINHAS:
+        raise ValueError('Carrinho inválido')
+    linhas = []
+    for item in carrinho:
+        try:
+            pid = int(item.get('id'))
+            sid = int(item['sabor_id']) if item.get('sabor_id') else None
+            qtd = int(item.get('quantidade', 1))
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError('Carrinho inválido')
+        if qtd < 1:
+            raise ValueError('Quantidade inválida no carrinho')
+        linhas.append((pid, sid, qtd))
+    return linhas
+
+
+def cotar_carrinho(linhas, cupom, cfg, catalogo):
+    """
+    Preços, desconto, frete e total do carrinho usando só o catálogo e as
+    configurações em memória. Linhas com produto ou sabor fora do catálogo
+    vão para 'indisponiveis' e não entram no total.
+    """
+    por_id, sabores = catalogo['por_id'], catalogo['sabores']
+
+    qtd_por_produto, qtd_por_sabor = {}, {}
+    for pid, sid, qtd in linhas:
+        qtd_por_produto[pid] = qtd_por_produto.get(pid, 0) + qtd
+        if sid:
+            qtd_por_sabor[sid] = qtd_por_sabor.get(sid, 0) + qtd
+
+    itens, indisponiveis = [], []
+    subtotal = 0.0
+    for pid, sid, qtd in linhas:
+        prod  = por_id.get(pid)
+        sabor = sabores.get(sid) if sid else None
+        if not prod:
+            motivo = 'Produto indisponível'
+        elif sid and (not sabor or sabor['produto_id'] != pid):
+            motivo = 'Sabor indisponível'
+        else:
+            motivo = None
+        if motivo:
+            indisponiveis.append({'id': pid, 'sabor_id': sid, 'quantidade': qtd, 'motivo': motivo})
+            continue
+
+        preco = round(prod['preco'] + (sabor['preco_adicional'] if sabor else 0), 2)
+        subtotal += preco * qtd
+        itens.append({
+            'id':                 pid,
+            'sabor_id':           sid,
+            'nome':               prod['nome'],
+            'sabor':              sabor['nome'] if sabor else None,
+            'preco_unit':         preco,
+            'quantidade':         qtd,
+            'subtotal':           round(preco * qtd, 2),
+            'estoque_suficiente': prod['estoque'] >= qtd_por_produto[pid]
+                                  and (not sabor or sabor['estoque'] >= qtd_por_sabor[sid]),
+        })
+
+    desconto = desconto_cupom(cupom, subtotal)
+    frete    = calcular_frete(subtotal - desconto, cfg) if itens else 0.0
+    return {
+        'itens':              itens,
+        'indisponiveis':      indisponiveis,
+        'subtotal':           round(subtotal, 2),
+        'desconto':           desconto,
+        'frete':              frete,
+        'frete_gratis_acima': cfg['frete_gratis_acima'],
+        'total':              round(subtotal - desconto + frete, 2),
+    }
+
+
+@app.route('/api/carrinho/cotacao', methods=['POST'])
+def cotar():
+    """
+    Recalcula o carrinho do localStorage com os preços do servidor.
+    Uma consulta no máximo (o cupom); o resto vem de CATALOGO e CONFIG.
+    """
+    d      = request.get_json() or {}
+    codigo = (d.get('cupom') or '').strip().upper()
+    try:
+        linhas = linhas_carrinho(d.get('carrinho', []))
+    except ValueError as e:
+        return err(str(e))
+
+    cfg, catalogo = CONFIG.obter(), CATALOGO.obter()
+    cotacao = cotar_carrinho(linhas, None, cfg, catalogo)
+
+    # Mesma regra de cupom do checkout, contra o subtotal calculado aqui
+    cupom, cupom_erro = None, None
+    if codigo:
+        try:
+            cupom, _ = aplicar_cupom(query, cotacao['subtotal'], codigo=codigo)
+            cotacao = cotar_carrinho(linhas, cupom, cfg, catalogo)
+        except CupomRecusado as e:
+            cupom_erro = str(e)
+
+    cotacao['cupom'] = {
+        'id':     cupom['id'],
+        'codigo': cupom['codigo'],
+        'tipo':   cupom['tipo'],
+        'valor':  float(cupom['valor']),
+    } if cupom else None
+    cotacao['cupom_erro'] = cupom_erro
+    return ok(cotacao)
+
 # ============================================================
 #  PEDIDOS
 # ============================================================
 
+class ReservaRecusada(Exception):
+    """Um ou mais itens do carrinho não puderam ser reservados."""
+
+    def __init__(self, itens):
+        super().__init__('Não foi possível reservar todos os itens do carrinho')
+        self.itens = itens
+
+
+def baixar_estoque(tx, tabela, qtd_por_id):
+    """
+    Baixa o estoque de {id: quantidade} em `tabela` num único UPDATE
+    condicional. O WHERE estoque >= qtd garante que nenhuma linha fique
+    negativa; retorna False se alguma linha não tinha saldo.
+    """
+    ids = sorted(qtd_por_id)
+    placeholders = ','.join(['%s'] * len(ids))
+    casos = ' '.join(['WHEN %s THEN %s'] * len(ids))
+    params_casos = tuple(v for i in ids for v in (i, qtd_por_id[i]))
+    afetadas = tx.execute(
+        f"""UPDATE {tabela} SET estoque = estoque - CASE id {casos} END
+            WHERE id IN ({placeholders}) AND estoque >= CASE id {casos} END""",
+        params_casos + tuple(ids) + params_casos
+    )
+    return afetadas == len(ids)
+
+
+def reservar_estoque(tx, qtd_por_produto):
+    """
+    Reserva o estoque de {produto_id: quantidade} dentro da transação `tx`.
+    Trava as linhas com SELECT ... FOR UPDATE (sempre em ordem de id, para
+    não gerar deadlock entre pedidos concorrentes), valida cada produto e
+    baixa o estoque num único UPDATE condicional.
+    Retorna {id: produto}; levanta ReservaRecusada com o detalhe por item.
+    """
+    ids = sorted(qtd_por_produto)
+    placeholders = ','.join(['%s'] * len(ids))
+    rows, _ = tx.query(
+        f"""SELECT id, nome, preco, peso_gramas, estoque, ativo FROM produtos
+            WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE""",
+        tuple(ids)
+    )
+    produtos = {r['id']: r for r in (rows or [])}
+
+    recusados = []
+    for pid in ids:
+        prod = produtos.get(pid)
+        qtd  = qtd_por_produto[pid]
+        if not prod or not prod['ativo']:
+            recusados.append({'produto_id': pid, 'nome': prod['nome'] if prod else None,
+                              'solicitado': qtd, 'disponivel': 0,
+                              'motivo': 'indisponivel'})
+        elif prod['estoque'] < qtd:
+            recusados.append({'produto_id': pid, 'nome': prod['nome'],
+                              'solicitado': qtd, 'disponivel': max(prod['estoque'], 0),
+                              'motivo': 'estoque_insuficiente'})
+    if recusados:
+        raise ReservaRecusada(recusados)
+
+    if not baixar_estoque(tx, 'produtos', qtd_por_produto):
+        raise ReservaRecusada([{'produto_id': pid, 'nome': produtos[pid]['nome'],
+                                'solicitado': qtd_por_produto[pid], 'disponivel': None,
+                                'motivo': 'estoque_insuficiente'} for pid in ids])
+    return produtos
+
+
+def reservar_sabores(tx, qtd_por_sabor, produto_do_sabor):
+    """
+    Igual a reservar_estoque, para {sabor_id: quantidade} em produto_sabores.
+    Chamada depois de reservar_estoque, na mesma transação: a ordem de
+    travamento (produtos, depois sabores, ambos por id) é sempre a mesma.
+    Confere também que o sabor pertence ao produto da linha.
+    """
+    ids = sorted(qtd_por_sabor)
+    placeholders = ','.join(['%s'] * len(ids))
+    rows, _ = tx.query(
+        f"""SELECT id, produto_id, nome, preco_adicional, peso_gramas, estoque, ativo
+            FROM produto_sabores
+            WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE""",
+        tuple(ids)
+    )
+    sabores = {r['id']: r for r in (rows or [])}
+
+    recusados = []
+    for sid in ids:
+        sabor = sabores.get(sid)
+        qtd   = qtd_por_sabor[sid]
+        pid   = produto_do_sabor[sid]
+        if not sabor or not sabor['ativo'] or sabor['produto_id'] != pid:
+            recusados.append({'produto_id': pid, 'sabor_id': sid, 'nome': sabor['nome'] if sabor else None,
+                              'solicitado': qtd, 'disponivel': 0,
+                              'motivo': 'indisponivel'})
+        elif sabor['estoque'] < qtd:
+            recusados.append({'produto_id': pid, 'sabor_id': sid, 'nome': sabor['nome'],
+                              'solicitado': qtd, 'disponivel': max(sabor['estoque'], 0),
+                              'motivo': 'estoque_insuficiente'})
+    if recusados:
+        raise ReservaRecusada(recusados)
+
+    if not baixar_estoque(tx, 'produto_sabores', qtd_por_sabor):
+        raise ReservaRecusada([{'produto_id': produto_do_sabor[sid], 'sabor_id': sid,
+                                'nome': sabores[sid]['nome'],
+                                'solicitado': qtd_por_sabor[sid], 'disponivel': None,
+                                'motivo': 'estoque_insuficiente'} for sid in ids])
+    return sabores
+
+
 @app.route('/api/pedidos', methods=['POST'])
 def criar_pedido():
     d = request.get_json() or {}
@@ -757,6 +2422,7 @@ def criar_pedido():
     entrega  = d.get('entrega', {})
     pagamento = d.get('forma_pagamento', 'whatsapp')
     cupom_id  = d.get('cupom_id')
+    codigo    = (d.get('cupom') or '').strip().upper()
     obs       = d.get('observacao', '')
 
     if not carrinho:
@@ -770,76 +2436,96 @@ def criar_pedido():
     uid = int(payload['sub']) if payload else None  # sub é string no JWT
 
     # Recalcula valores no servidor (nunca confie no frontend)
-    subtotal = 0.0
-    itens_validados = []
-    for item in carrinho:
-        prod, _ = query(
-            "SELECT id, nome, preco, estoque FROM produtos WHERE id=%s AND ativo=1",
-            (item.get('id'),), fetch='one'
-        )
-        if not prod:
-            return err(f'Produto #{item.get("id")} não encontrado ou inativo')
-        qtd = int(item.get('quantidade', 1))
-        if prod['estoque'] < qtd:
-            return err(f'Estoque insuficiente para: {prod["nome"]}')
-        preco = float(prod['preco'])
-        subtotal += preco * qtd
-        itens_validados.append({'prod': prod, 'qtd': qtd, 'preco': preco})
-
-    # Desconto do cupom
-    desconto = 0.0
-    if cupom_id:
-        cupom, _ = query("SELECT * FROM cupons WHERE id=%s AND ativo=1", (cupom_id,), fetch='one')
-        if cupom:
-            v = float(cupom['valor'])
-            desconto = round(subtotal * v / 100, 2) if cupom['tipo'] == 'percentual' else min(v, subtotal)
-
-    # Frete
-    cfg_frete, _ = query(
-        "SELECT valor FROM configuracoes WHERE chave='frete_padrao'", fetch='one')
-    cfg_gratis, _ = query(
-        "SELECT valor FROM configuracoes WHERE chave='frete_gratis_acima'", fetch='one')
-    frete_padrao  = float(cfg_frete['valor']  if cfg_frete  else 15.00)
-    frete_gratis  = float(cfg_gratis['valor'] if cfg_gratis else 150.00)
-    frete = 0.0 if (subtotal - desconto) >= frete_gratis else frete_padrao
-    total = round(subtotal - desconto + frete, 2)
-
-    # Salva pedido
-    _, ped_id = query(
-        """INSERT INTO pedidos
-           (usuario_id, cupom_id,
-            nome_cliente, email_cliente, telefone_cliente,
-            cep, logradouro, numero, complemento, bairro, cidade, estado,
-            subtotal, desconto, frete, total,
-            forma_pagamento, status_pagamento, status, observacao)
-           VALUES
-           (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
-        (uid, cupom_id or None,
-         cliente['nome'], cliente['email'], cliente.get('telefone'),
-         entrega.get('cep'), entrega.get('logradouro'), entrega.get('numero'),
-         entrega.get('complemento'), entrega.get('bairro'),
-         entrega.get('cidade'), entrega.get('estado'),
-         subtotal, desconto, frete, total,
-         pagamento, 'pendente', 'aguardando_pagamento', obs),
-        fetch='none'
-    )
-
-    # Salva itens e baixa estoque
-    for it in itens_validados:
-        query(
-            """INSERT INTO pedido_itens (pedido_id, produto_id, nome, preco_unit, quantidade, subtotal)
-               VALUES (%s,%s,%s,%s,%s,%s)""",
-            (ped_id, it['prod']['id'], it['prod']['nome'],
-             it['preco'], it['qtd'], round(it['preco'] * it['qtd'], 2)),
-            fetch='none'
-        )
-        query("UPDATE produtos SET estoque = estoque - %s WHERE id=%s",
-              (it['qtd'], it['prod']['id']), fetch='none')
-
-    # Incrementa uso do cupom
-    if cupom_id:
-        query("UPDATE cupons SET total_usado = total_usado + 1 WHERE id=%s",
-              (cupom_id,), fetch='none')
+    try:
+        linhas = linhas_carrinho(carrinho)
+    except ValueError as e:
+        return err(str(e))
+
+    # Linha com sabor baixa o estoque do produto e o do sabor
+    qtd_por_produto, qtd_por_sabor, produto_do_sabor = {}, {}, {}
+    for pid, sid, qtd in linhas:
+        qtd_por_produto[pid] = qtd_por_produto.get(pid, 0) + qtd
+        if sid:
+            if produto_do_sabor.setdefault(sid, pid) != pid:
+                return err('Sabor não pertence ao produto do carrinho')
+            qtd_por_sabor[sid] = qtd_por_sabor.get(sid, 0) + qtd
+
+    # Frete vem do cache de configurações
+    cfg = CONFIG.obter()
+
+    # Reserva, pedido, itens e cupom entram juntos (um único COMMIT)
+    try:
+        with transaction() as tx:
+            produtos = reservar_estoque(tx, qtd_por_produto)
+            sabores  = reservar_sabores(tx, qtd_por_sabor, produto_do_sabor) if qtd_por_sabor else {}
+
+            # Preço da linha = preço base + adicional do sabor (mesma regra da cotação)
+            subtotal = 0.0
+            itens_validados = []
+            for pid, sid, qtd in linhas:
+                prod  = produtos[pid]
+                sabor = sabores[sid] if sid else None
+                preco = round(float(prod['preco'])
+                              + (float(sabor['preco_adicional']) if sabor else 0), 2)
+                subtotal += preco * qtd
+                itens_validados.append({'prod': prod, 'sabor': sabor, 'qtd': qtd, 'preco': preco})
+            subtotal = round(subtotal, 2)
+
+            # Cupom com as mesmas regras da cotação, travado até o COMMIT
+            cupom, desconto = None, 0.0
+            if codigo or cupom_id:
+                cupom, desconto = aplicar_cupom(tx.query, subtotal, codigo=codigo,
+                                                cupom_id=cupom_id, travar=True)
+            frete    = calcular_frete(subtotal - desconto, cfg)
+            total    = round(subtotal - desconto + frete, 2)
+
+            _, ped_id = tx.query(
+                """INSERT INTO pedidos
+                   (usuario_id, cupom_id,
+                    nome_cliente, email_cliente, telefone_cliente,
+                    cep, logradouro, numero, complemento, bairro, cidade, estado,
+                    subtotal, desconto, frete, total,
+                    forma_pagamento, status_pagamento, status, observacao)
+                   VALUES
+                   (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
+                (uid, cupom['id'] if cupom else None,
+                 cliente['nome'], cliente['email'], cliente.get('telefone'),
+                 entrega.get('cep'), entrega.get('logradouro'), entrega.get('numero'),
+                 entrega.get('complemento'), entrega.get('bairro'),
+                 entrega.get('cidade'), entrega.get('estado'),
+                 subtotal, desconto, frete, total,
+                 pagamento, 'pendente', 'aguardando_pagamento', obs),
+                fetch='none'
+            )
+
+            # Itens num único INSERT multi-linha
+            tx.executemany(
+                """INSERT INTO pedido_itens
+                   (pedido_id, produto_id, sabor_id, nome_produto, nome_sabor,
+                    peso_gramas, preco_unit, quantidade, subtotal)
+                   VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
+                [(ped_id, it['prod']['id'],
+                  it['sabor']['id'] if it['sabor'] else None,
+                  it['prod']['nome'],
+                  it['sabor']['nome'] if it['sabor'] else None,
+                  (it['sabor'] or {}).get('peso_gramas') or it['prod']['peso_gramas'],
+                  it['preco'], it['qtd'], round(it['preco'] * it['qtd'], 2))
+                 for it in itens_validados]
+            )
+
+            # Incrementa uso do cupom
+            if cupom:
+                tx.query("UPDATE cupons SET total_usado = total_usado + 1 WHERE id=%s",
+                         (cupom['id'],), fetch='none')
+
+            resumo_pedido(tx, ped_id, +1)
+    except ReservaRecusada as e:
+        return err(str(e), 409, {'itens': e.itens})
+    except CupomRecusado as e:
+        return err(str(e), 409)
+
+    # Estoque mudou: o catálogo em memória precisa ser recarregado
+    CATALOGO.invalidar()
 
     if uid:
         log(uid, 'novo_pedido', f'Pedido #{ped_id} — R$ {total:.2f}')
@@ -892,14 +2578,186 @@ def detalhe_pedido(pid):
 # ============================================================
 UPLOAD_FOLDER   = os.path.join(os.path.dirname(__file__), 'assets', 'img_produtos')
 ALLOWED_EXT     = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+UPLOAD_MAX_MB   = int(os.environ.get('UPLOAD_MAX_MB', 8))   # só na rota de upload
+UPLOAD_BLOCO    = 64 * 1024   # bytes lidos por vez do arquivo recebido
+
+# Larguras (px) das variantes geradas para cada imagem
+IMAGEM_VARIANTES = {'thumb': 160, 'card': 480, 'full': 1200}
+IMAGEM_QUALIDADE = {'WEBP': 80, 'JPEG': 82}
+IMAGEM_PREFIXO   = '/assets/img_produtos/'
+
+# <nome>-<largura>w.<ext> gravado ao lado do original
+_VARIANTE = re.compile(r'^(.+)-(\d+)w\.(webp|jpg)$')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXT
 
+
+def tipo_imagem(cabecalho):
+    """Extensão pelo conteúdo (assinatura dos primeiros bytes), ou None."""
+    if cabecalho.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if cabecalho.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if cabecalho[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class GeradorVariantes:
+    """
+    Gera em segundo plano versões redimensionadas de cada imagem enviada
+    (WebP + JPEG, sem EXIF/metadados, nunca ampliadas), gravadas ao lado
+    do original como <nome>-<largura>w.<ext>. O mapa de srcset vem de uma
+    listagem da pasta, refeita só quando o mtime dela muda — servir o
+    mapa não depende do Pillow.
+    """
+
+    def __init__(self, pasta, variantes):
+        self.pasta     = pasta
+        self.variantes = variantes
+        self._pid    = None
+        self._lock   = threading.Lock()
+        self._fila   = queue.Queue()
+        self._mtime  = None
+        self._indice = {}
+        self._stats  = {'geradas': 0, 'erros': 0}
+
+    def garantir_ativo(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid  = os.getpid()
+            self._fila = queue.Queue()
+            threading.Thread(target=self._loop, name='variantes-imagem', daemon=True).start()
+
+    def agendar(self, nome):
+        if not PIL_DISPONIVEL:
+            return
+        self.garantir_ativo()
+        self._fila.put(nome)
+
+    def _loop(self):
+        while True:
+            nome = self._fila.get()
+            try:
+                self.gerar(nome)
+            except Exception as e:
+                print(f'[IMG] Falha ao gerar variantes de {nome}: {e}')
+                with self._lock:
+                    self._stats['erros'] += 1
+            else:
+                CATALOGO.invalidar()
+
+    def gerar(self, nome):
+        """Gera as variantes de um arquivo da pasta; retorna quantas gravou."""
+        base = nome.rsplit('.', 1)[0]
+        with Image.open(os.path.join(self.pasta, nome)) as original:
+            img = ImageOps.exif_transpose(original)
+            alfa = img.mode in ('RGBA', 'LA') or 'transparency' in img.info
+            larguras = sorted({min(l, img.width) for l in self.variantes.values()})
+            for largura in larguras:
+                altura = max(1, round(img.height * largura / img.width))
+                copia = img.resize((largura, altura), Image.LANCZOS) if largura < img.width else img
+                self._salvar(copia.convert('RGBA' if alfa else 'RGB'),
+                             f'{base}-{largura}w.webp', 'WEBP', method=4)
+                self._salvar(copia.convert('RGB'), f'{base}-{largura}w.jpg', 'JPEG',
+                             optimize=True, progressive=True)
+        with self._lock:
+            self._stats['geradas'] += 2 * len(larguras)
+        return 2 * len(larguras)
+
+    def _salvar(self, img, nome, formato, **opcoes):
+        destino = os.path.join(self.pasta, nome)
+        img.save(destino + '.tmp', formato, quality=IMAGEM_QUALIDADE[formato], **opcoes)
+        os.replace(destino + '.tmp', destino)
+
+    def _variantes_na_pasta(self):
+        try:
+            mtime = os.stat(self.pasta).st_mtime
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            indice = {}
+            for arquivo in os.listdir(self.pasta):
+                m = _VARIANTE.match(arquivo)
+                if m:
+                    indice.setdefault(m.group(1), []).append((int(m.group(2)), m.group(3), arquivo))
+            self._indice, self._mtime = indice, mtime
+        return self._indice
+
+    def tem_variantes(self, nome):
+        return nome.rsplit('.', 1)[0] in self._variantes_na_pasta()
+
+    def srcset(self, url):
+        """
+        Mapa pronto para <img srcset>: {'webp': ..., 'jpeg': ..., 'src': JPEG
+        do card, 'thumb'/'card'/'full': URL WebP}. None se não houver variantes.
+        """
+        if not url or not url.startswith(IMAGEM_PREFIXO):
+            return None
+        variantes = self._variantes_na_pasta().get(url[len(IMAGEM_PREFIXO):].rsplit('.', 1)[0])
+        if not variantes:
+            return None
+        por_ext = {'webp': [], 'jpg': []}
+        for largura, ext, arquivo in sorted(variantes):
+            por_ext[ext].append((largura, IMAGEM_PREFIXO + arquivo))
+        mapa = {
+            'webp': ', '.join(f'{u} {l}w' for l, u in por_ext['webp']),
+            'jpeg': ', '.join(f'{u} {l}w' for l, u in por_ext['jpg']),
+        }
+        if por_ext['jpg']:
+            mapa['src'] = self._menor_que_cobre(por_ext['jpg'], self.variantes['card'])
+        if por_ext['webp']:
+            for rotulo, alvo in self.variantes.items():
+                mapa[rotulo] = self._menor_que_cobre(por_ext['webp'], alvo)
+        return mapa
+
+    @staticmethod
+    def _menor_que_cobre(lista, alvo):
+        """Menor variante com largura >= alvo (ou a maior, se nenhuma cobrir)."""
+        return next((u for l, u in lista if l >= alvo), lista[-1][1])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, na_fila=self._fila.qsize(), pillow=PIL_DISPONIVEL)
+
+
+VARIANTES = GeradorVariantes(UPLOAD_FOLDER, IMAGEM_VARIANTES)
+
+
+@app.cli.command('gerar-variantes')
+def comando_gerar_variantes():
+    """Backfill: gera as variantes das imagens já enviadas (flask --app app gerar-variantes)."""
+    if not PIL_DISPONIVEL:
+        print('❌  Instale o Pillow primeiro: pip install Pillow')
+        return
+    total = 0
+    for nome in sorted(os.listdir(UPLOAD_FOLDER)):
+        if _VARIANTE.match(nome) or not allowed_file(nome) or VARIANTES.tem_variantes(nome):
+            continue
+        try:
+            total += VARIANTES.gerar(nome)
+            print(f'  ✅  {nome}')
+        except Exception as e:
+            print(f'  ⚠  {nome}: {e}')
+    print(f'  {total} variante(s) gerada(s).')
+
 @app.route('/api/upload/produto-imagem', methods=['POST'])
 @requer_admin
 def upload_produto_imagem():
     """Recebe uma imagem, salva em assets/img_produtos/ e retorna a URL."""
+    # Tamanho conferido pelo cabeçalho, antes de request.files ler o corpo
+    tamanho = request.content_length
+    if tamanho is None:
+        return err('Envio sem Content-Length não é aceito.', 411)
+    if tamanho > UPLOAD_MAX_MB * 1024 * 1024:
+        return err(f'Arquivo muito grande. Limite: {UPLOAD_MAX_MB} MB.', 413)
+
     if 'imagem' not in request.files:
         return err('Nenhum arquivo enviado')
     file = request.files['imagem']
@@ -908,16 +2766,42 @@ def upload_produto_imagem():
     if not allowed_file(file.filename):
         return err('Formato não permitido. Use PNG, JPG, JPEG, GIF ou WEBP.')
 
-    # Cria pasta se não existir
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-    # Nome único para evitar conflitos
-    ext      = file.filename.rsplit('.', 1)[1].lower()
-    filename = f"{uuid.uuid4().hex}.{ext}"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
+    # O Werkzeug já recebeu o multipart (arquivos grandes ficam num
+    # temporário em disco). Aqui a cópia é em blocos: confere a assinatura,
+    # calcula o SHA-256 e grava no destino numa passada só
+    cabecalho = file.stream.read(UPLOAD_BLOCO)
+    ext = tipo_imagem(cabecalho)
+    if not ext:
+        return err('O conteúdo do arquivo não é uma imagem PNG, JPG, GIF ou WEBP.')
+
+    digest = hashlib.sha256()
+    temp   = os.path.join(UPLOAD_FOLDER, f'.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(temp, 'wb') as f:
+            bloco = cabecalho
+            while bloco:
+                digest.update(bloco)
+                f.write(bloco)
+                bloco = file.stream.read(UPLOAD_BLOCO)
+
+        # Endereçado pelo conteúdo: o mesmo arquivo sempre tem o mesmo nome
+        filename  = f'{digest.hexdigest()}.{ext}'
+        filepath  = os.path.join(UPLOAD_FOLDER, filename)
+        duplicada = os.path.exists(filepath)
+        if not duplicada:
+            os.replace(temp, filepath)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+    if not VARIANTES.tem_variantes(filename):
+        VARIANTES.agendar(filename)
 
     url = f'/assets/img_produtos/{filename}'
+    if duplicada:
+        return ok({'url': url, 'duplicada': True}, 'Imagem já existente reaproveitada.')
     return ok({'url': url}, 'Imagem enviada com sucesso!')
 
 # ============================================================
@@ -969,56 +2853,86 @@ def config_publica():
     chaves_publicas = ('nome_loja','whatsapp','email_loja',
                        'frete_gratis_acima','frete_padrao',
                        'instagram','facebook')
-    rows, _ = query(
-        f"SELECT chave, valor FROM configuracoes WHERE chave IN {chaves_publicas}"
-    )
-    return ok({r['chave']: r['valor'] for r in (rows or [])})
+    brutos = CONFIG.brutos()
+    return ok_cacheavel({c: brutos[c] for c in chaves_publicas if c in brutos},
+                        CONFIG.versao())
 
 # ============================================================
 #  ÁREA ADMIN
 # ============================================================
 
 # ── Dashboard ──────────────────────────────────────────────
+DASHBOARD_TTL   = int(os.environ.get('DASHBOARD_TTL', 15))  # segundos
+DASHBOARD_CACHE = CacheTTL(DASHBOARD_TTL)
+
 @app.route('/api/admin/dashboard', methods=['GET'])
 @requer_admin
 def admin_dashboard():
-    total_usuarios, _ = query(
-        "SELECT COUNT(*) AS n FROM usuarios WHERE tipo='cliente'", fetch='one')
-    total_pedidos, _ = query(
-        "SELECT COUNT(*) AS n FROM pedidos", fetch='one')
-    faturamento, _ = query(
-        "SELECT COALESCE(SUM(total),0) AS v FROM pedidos WHERE status_pagamento='aprovado'",
-        fetch='one')
-    pedidos_hoje, _ = query(
-        "SELECT COUNT(*) AS n FROM pedidos WHERE DATE(criado_em)=CURDATE()", fetch='one')
-    contatos_nao_lidos, _ = query(
-        "SELECT COUNT(*) AS n FROM contatos WHERE lida=0", fetch='one')
-    avaliacoes_pendentes, _ = query(
-        "SELECT COUNT(*) AS n FROM avaliacoes WHERE aprovada=0", fetch='one')
-    produtos_sem_estoque, _ = query(
-        "SELECT COUNT(*) AS n FROM produtos WHERE estoque=0 AND ativo=1", fetch='one')
+    return ok(DASHBOARD_CACHE.obter('kpis', carregar_kpis_dashboard))
+
+
+def carregar_kpis_dashboard():
+    """Todos os KPIs do painel num único round-trip."""
+    row, _ = query(
+        """SELECT
+             (SELECT COUNT(*) FROM usuarios WHERE tipo='cliente')          AS usuarios,
+             (SELECT COUNT(*) FROM pedidos)                                AS pedidos_total,
+             (SELECT COALESCE(SUM(total),0) FROM pedidos
+               WHERE status_pagamento='aprovado')                          AS faturamento,
+             (SELECT COUNT(*) FROM pedidos
+               WHERE criado_em >= CURDATE()
+                 AND criado_em <  CURDATE() + INTERVAL 1 DAY)              AS pedidos_hoje,
+             (SELECT COUNT(*) FROM contatos WHERE lida=0)                  AS contatos_nao_lidos,
+             (SELECT COUNT(*) FROM avaliacoes WHERE aprovada=0)            AS avaliacoes_pendentes,
+             (SELECT COUNT(*) FROM produtos WHERE estoque=0 AND ativo=1)   AS produtos_sem_estoque""",
+        fetch='one'
+    )
+    return {
+        'usuarios':            row['usuarios'],
+        'pedidos_total':       row['pedidos_total'],
+        'faturamento':         float(row['faturamento']),
+        'pedidos_hoje':        row['pedidos_hoje'],
+        'contatos_nao_lidos':  row['contatos_nao_lidos'],
+        'avaliacoes_pendentes':row['avaliacoes_pendentes'],
+        'produtos_sem_estoque':row['produtos_sem_estoque'],
+    }
 
+# ── Métricas internas do worker ────────────────────────────
+@app.route('/api/admin/metricas', methods=['GET'])
+@requer_admin
+def admin_metricas():
     return ok({
-        'usuarios':            total_usuarios['n'],
-        'pedidos_total':       total_pedidos['n'],
-        'faturamento':         float(faturamento['v']),
-        'pedidos_hoje':        pedidos_hoje['n'],
-        'contatos_nao_lidos':  contatos_nao_lidos['n'],
-        'avaliacoes_pendentes':avaliacoes_pendentes['n'],
-        'produtos_sem_estoque':produtos_sem_estoque['n'],
+        'pid':       os.getpid(),
+        'db_pool':   POOL.stats(),
+        'catalogo':  CATALOGO.stats(),
+        'busca':     BUSCA.stats(),
+        'email':     REMETENTE.stats(),
+        'auditoria': AUDITORIA.stats(),
+        'jwt_cache': TOKENS_VERIFICADOS.stats(),
+        'senhas':    SENHAS.stats(),
+        'imagens':   VARIANTES.stats(),
+        'paginas':   PAGINAS_RENDERIZADAS.stats(),
+        'config':    CONFIG.stats(),
+        'limites':   {l.nome: l.stats() for l in (LOGIN_POR_IP, LOGIN_POR_EMAIL,
+                                                  RECUPERACAO_POR_IP, RECUPERACAO_POR_EMAIL)},
     })
 
 # ── Usuários (admin) ───────────────────────────────────────
 @app.route('/api/admin/usuarios', methods=['GET'])
 @requer_admin
 def admin_listar_usuarios():
-    rows, _ = query(
-        """SELECT id, nome, sobrenome, email, tipo, ativo, criado_em
-           FROM usuarios ORDER BY criado_em DESC"""
-    )
-    for r in (rows or []):
+    limite = limite_admin()
+    try:
+        rows, proximo = pagina_keyset(
+            """SELECT id, nome, sobrenome, email, tipo, ativo, criado_em
+               FROM usuarios {where}""",
+            [], [], request.args.get('after'), limite, 'criado_em', 'id'
+        )
+    except ValueError as e:
+        return err(str(e))
+    for r in rows:
         r['criado_em'] = str(r['criado_em'])
-    return ok(rows)
+    return ok(rows, proximo=proximo)
 
 
 @app.route('/api/admin/usuarios/<int:uid>/ativar', methods=['PATCH'])
@@ -1080,6 +2994,8 @@ def admin_criar_produto():
          1 if d.get('destaque') else 0),
         fetch='none'
     )
+    CATALOGO.invalidar()
+    BUSCA.atualizar_produto(pid)
     return ok({'id': pid}, 'Produto criado!', 201)
 
 
@@ -1101,6 +3017,8 @@ def admin_atualizar_produto(pid):
          1 if d.get('destaque') else 0, pid),
         fetch='none'
     )
+    CATALOGO.invalidar()
+    BUSCA.atualizar_produto(pid)
     return ok(msg='Produto atualizado!')
 
 
@@ -1108,6 +3026,8 @@ def admin_atualizar_produto(pid):
 @requer_admin
 def admin_deletar_produto(pid):
     query("UPDATE produtos SET ativo=0 WHERE id=%s", (pid,), fetch='none')
+    CATALOGO.invalidar()
+    BUSCA.atualizar_produto(pid)
     return ok(msg='Produto desativado.')
 
 # ── Pedidos (admin) ────────────────────────────────────────
@@ -1115,24 +3035,25 @@ def admin_deletar_produto(pid):
 @requer_admin
 def admin_listar_pedidos():
     status = request.args.get('status')
-    params = []
-    where  = ''
+    limite = limite_admin()
+    where, params = [], []
     if status:
-        where = 'WHERE p.status=%s'
+        where.append('p.status=%s')
         params.append(status)
-    rows, _ = query(
-        f"""SELECT p.id, p.nome_cliente, p.email_cliente, p.total,
-                   p.status, p.status_pagamento, p.forma_pagamento,
-                   p.criado_em, p.rastreamento
-            FROM pedidos p {where}
-            ORDER BY p.criado_em DESC
-            LIMIT 200""",
-        params
-    )
-    for r in (rows or []):
+    try:
+        rows, proximo = pagina_keyset(
+            """SELECT p.id, p.nome_cliente, p.email_cliente, p.total,
+                      p.status, p.status_pagamento, p.forma_pagamento,
+                      p.criado_em, p.rastreamento
+               FROM pedidos p {where}""",
+            where, params, request.args.get('after'), limite, 'p.criado_em', 'p.id'
+        )
+    except ValueError as e:
+        return err(str(e))
+    for r in rows:
         r['total']     = float(r['total'])
         r['criado_em'] = str(r['criado_em'])
-    return ok(rows)
+    return ok(rows, proximo=proximo)
 
 
 @app.route('/api/admin/pedidos/<int:pid>/status', methods=['PATCH'])
@@ -1155,7 +3076,12 @@ def admin_atualizar_status_pedido(pid):
         return err('Nada para atualizar')
 
     vals.append(pid)
-    query(f"UPDATE pedidos SET {', '.join(sets)} WHERE id=%s", vals, fetch='none')
+    with transaction() as tx:
+        # Move o pedido do balde antigo para o novo no resumo diário
+        tx.query("SELECT id FROM pedidos WHERE id=%s FOR UPDATE", (pid,), fetch='one')
+        resumo_pedido(tx, pid, -1)
+        tx.query(f"UPDATE pedidos SET {', '.join(sets)} WHERE id=%s", vals, fetch='none')
+        resumo_pedido(tx, pid, +1)
     log(request.usuario_id, 'atualizar_pedido', f'Pedido #{pid} → {status or status_pag}')
     return ok(msg='Pedido atualizado.')
 
@@ -1163,10 +3089,17 @@ def admin_atualizar_status_pedido(pid):
 @app.route('/api/admin/contatos', methods=['GET'])
 @requer_admin
 def admin_listar_contatos():
-    rows, _ = query("SELECT * FROM contatos ORDER BY criado_em DESC LIMIT 200")
-    for r in (rows or []):
+    limite = limite_admin()
+    try:
+        rows, proximo = pagina_keyset(
+            "SELECT * FROM contatos {where}",
+            [], [], request.args.get('after'), limite, 'criado_em', 'id'
+        )
+    except ValueError as e:
+        return err(str(e))
+    for r in rows:
         r['criado_em'] = str(r['criado_em'])
-    return ok(rows)
+    return ok(rows, proximo=proximo)
 
 
 @app.route('/api/admin/contatos/<int:cid>/lida', methods=['PATCH'])
@@ -1179,24 +3112,59 @@ def admin_marcar_contato(cid):
 @app.route('/api/admin/avaliacoes', methods=['GET'])
 @requer_admin
 def admin_listar_avaliacoes():
-    rows, _ = query(
-        """SELECT a.*, p.nome AS produto_nome
-           FROM avaliacoes a JOIN produtos p ON p.id=a.produto_id
-           ORDER BY a.criado_em DESC"""
-    )
-    for r in (rows or []):
+    limite = limite_admin()
+    try:
+        rows, proximo = pagina_keyset(
+            """SELECT a.*, p.nome AS produto_nome
+               FROM avaliacoes a JOIN produtos p ON p.id=a.produto_id {where}""",
+            [], [], request.args.get('after'), limite, 'a.criado_em', 'a.id'
+        )
+    except ValueError as e:
+        return err(str(e))
+    for r in rows:
         r['criado_em'] = str(r['criado_em'])
-    return ok(rows)
+    return ok(rows, proximo=proximo)
 
 
 @app.route('/api/admin/avaliacoes/<int:aid>/aprovar', methods=['PATCH'])
 @requer_admin
 def admin_aprovar_avaliacao(aid):
     d = request.get_json() or {}
-    query("UPDATE avaliacoes SET aprovada=%s WHERE id=%s",
-          (1 if d.get('aprovada') else 0, aid), fetch='none')
+    aprovada = 1 if d.get('aprovada') else 0
+    with transaction() as tx:
+        av, _ = tx.query("SELECT produto_id, nota, aprovada FROM avaliacoes WHERE id=%s FOR UPDATE",
+                         (aid,), fetch='one')
+        if not av:
+            return err('Avaliação não encontrada', 404)
+        mudou = av['aprovada'] != aprovada
+        if mudou:
+            tx.query("UPDATE avaliacoes SET aprovada=%s WHERE id=%s", (aprovada, aid), fetch='none')
+            agregado_avaliacao(tx, av['produto_id'], av['nota'], +1 if aprovada else -1)
+    if mudou:
+        CATALOGO.invalidar()
     return ok(msg='Avaliação atualizada.')
 
+
+def agregado_avaliacao(tx, produto_id, nota, sinal):
+    """
+    Soma (sinal=+1) ou retira (sinal=-1) uma nota do histograma do produto e
+    recalcula total_avaliacoes/nota_media a partir dele. No UPDATE do MySQL
+    as atribuições são avaliadas em ordem, já com os valores novos.
+    Reconstrução completa: python criar_bd.py reconstruir-avaliacoes
+    """
+    coluna = f'avaliacoes_{int(nota)}'
+    tx.query(
+        f"""UPDATE produtos SET
+              {coluna}         = GREATEST(CAST({coluna} AS SIGNED) + %s, 0),
+              total_avaliacoes = avaliacoes_1 + avaliacoes_2 + avaliacoes_3
+                               + avaliacoes_4 + avaliacoes_5,
+              nota_media       = IF(total_avaliacoes = 0, 0,
+                                    (avaliacoes_1 + 2 * avaliacoes_2 + 3 * avaliacoes_3
+                                     + 4 * avaliacoes_4 + 5 * avaliacoes_5) / total_avaliacoes)
+            WHERE id=%s""",
+        (sinal, produto_id), fetch='none'
+    )
+
 # ── Configurações (admin) ──────────────────────────────────
 @app.route('/api/admin/config', methods=['GET'])
 @requer_admin
@@ -1208,14 +3176,72 @@ def admin_listar_config():
 @app.route('/api/admin/config', methods=['PUT'])
 @requer_admin
 def admin_atualizar_config():
-    d = request.get_json() or {}
+    try:
+        valores = validar_configuracoes(request.get_json(silent=True))
+    except ValueError as e:
+        return err(str(e))
+    alteradas = salvar_configuracoes(valores)
+    return ok({'alteradas': alteradas}, 'Configurações salvas.')
+
+
+_CHAVE_CONFIG = re.compile(r'^[a-z0-9_]{1,80}$')
+
+
+def validar_configuracoes(d, permitidas=None):
+    """
+    Confere o corpo {chave: valor} antes de qualquer escrita e normaliza os
+    valores para texto (a coluna é TEXT). Levanta ValueError com a mensagem
+    para o cliente.
+    """
+    if not isinstance(d, dict) or not d:
+        raise ValueError('Envie um objeto JSON com as configurações')
+    invalidas = [c for c in d if not _CHAVE_CONFIG.match(c)
+                 or (permitidas is not None and c not in permitidas)]
+    if invalidas:
+        raise ValueError(f'Chave(s) não permitida(s): {", ".join(sorted(invalidas))}')
+    valores = {}
     for chave, valor in d.items():
-        query(
-            "INSERT INTO configuracoes (chave, valor) VALUES (%s,%s) "
-            "ON DUPLICATE KEY UPDATE valor=%s",
-            (chave, valor, valor), fetch='none'
+        if isinstance(valor, bool):
+            valor = '1' if valor else '0'
+        elif isinstance(valor, (int, float)):
+            valor = str(valor)
+        elif valor is not None and not isinstance(valor, str):
+            raise ValueError(f'Valor inválido para {chave}')
+        tipo = CONFIG_TIPOS.get(chave, (str,))[0]
+        if tipo is float and valor not in (None, ''):
+            try:
+                float(valor)
+            except ValueError:
+                raise ValueError(f'{chave} deve ser numérico')
+        valores[chave] = valor
+    return valores
+
+
+def salvar_configuracoes(valores):
+    """
+    Grava só as chaves cujo valor mudou, num único INSERT multi-linha
+    ... ON DUPLICATE KEY UPDATE dentro de uma transação. O cache de
+    configurações só é invalidado se algo mudou. Retorna as chaves alteradas.
+    """
+    chaves = sorted(valores)
+    with transaction() as tx:
+        atuais, _ = tx.query(
+            f"SELECT chave, valor FROM configuracoes WHERE chave IN ({','.join(['%s'] * len(chaves))}) "
+            "FOR UPDATE",
+            chaves
         )
-    return ok(msg='Configurações salvas.')
+        atuais = {r['chave']: r['valor'] for r in (atuais or [])}
+        alteradas = [c for c in chaves if c not in atuais or atuais[c] != valores[c]]
+        if alteradas:
+            tx.query(
+                "INSERT INTO configuracoes (chave, valor) VALUES "
+                + ','.join(['(%s,%s)'] * len(alteradas))
+                + " ON DUPLICATE KEY UPDATE valor=VALUES(valor)",
+                [v for c in alteradas for v in (c, valores[c])], fetch='none'
+            )
+    if alteradas:
+        CONFIG.invalidar()
+    return alteradas
 
 # ── Cupons (admin) ─────────────────────────────────────────
 @app.route('/api/admin/cupons', methods=['GET'])
@@ -1292,13 +3318,15 @@ def admin_criar_despesa():
     d = request.get_json() or {}
     if not d.get('descricao') or not d.get('valor'):
         return err('Descricao e valor sao obrigatorios')
-    query(
-        """INSERT INTO despesas (descricao, categoria, valor, data_despesa, observacao)
-           VALUES (%s, %s, %s, %s, %s)""",
-        (d['descricao'], d.get('categoria', 'outros'),
-         d['valor'], d.get('data_despesa'), d.get('observacao')),
-        fetch='none'
-    )
+    with transaction() as tx:
+        _, did = tx.query(
+            """INSERT INTO despesas (descricao, categoria, valor, data_despesa, observacao)
+               VALUES (%s, %s, %s, COALESCE(%s, CURDATE()), %s)""",
+            (d['descricao'], d.get('categoria', 'outros'),
+             d['valor'], d.get('data_despesa'), d.get('observacao')),
+            fetch='none'
+        )
+        resumo_despesa(tx, did, +1)
     return ok(msg='Despesa registrada!', code=201)
 
 
@@ -1306,20 +3334,27 @@ def admin_criar_despesa():
 @requer_admin
 def admin_atualizar_despesa(did):
     d = request.get_json() or {}
-    query(
-        """UPDATE despesas SET descricao=%s, categoria=%s, valor=%s,
-           data_despesa=%s, observacao=%s WHERE id=%s""",
-        (d.get('descricao'), d.get('categoria'), d.get('valor'),
-         d.get('data_despesa'), d.get('observacao'), did),
-        fetch='none'
-    )
+    with transaction() as tx:
+        tx.query("SELECT id FROM despesas WHERE id=%s FOR UPDATE", (did,), fetch='one')
+        resumo_despesa(tx, did, -1)
+        tx.query(
+            """UPDATE despesas SET descricao=%s, categoria=%s, valor=%s,
+               data_despesa=%s, observacao=%s WHERE id=%s""",
+            (d.get('descricao'), d.get('categoria'), d.get('valor'),
+             d.get('data_despesa'), d.get('observacao'), did),
+            fetch='none'
+        )
+        resumo_despesa(tx, did, +1)
     return ok(msg='Despesa atualizada!')
 
 
 @app.route('/api/admin/despesas/<int:did>', methods=['DELETE'])
 @requer_admin
 def admin_deletar_despesa(did):
-    query("DELETE FROM despesas WHERE id=%s", (did,), fetch='none')
+    with transaction() as tx:
+        tx.query("SELECT id FROM despesas WHERE id=%s FOR UPDATE", (did,), fetch='one')
+        resumo_despesa(tx, did, -1)
+        tx.query("DELETE FROM despesas WHERE id=%s", (did,), fetch='none')
     return ok(msg='Despesa removida.')
 
 
@@ -1327,106 +3362,110 @@ def admin_deletar_despesa(did):
 #  FINANCEIRO — resumo + graficos (admin)
 # ============================================================
 
+# Os relatórios leem apenas as tabelas de resumo diário, mantidas
+# incrementalmente pelas escritas em pedidos e despesas.
+# Reconstrução completa: python criar_bd.py reconstruir-financeiro
+
+def resumo_pedido(tx, pedido_id, sinal):
+    """Soma (sinal=+1) ou retira (sinal=-1) um pedido do resumo diário."""
+    tx.query(
+        """INSERT INTO resumo_diario_pedidos
+               (dia, forma_pagamento, status, status_pagamento, pedidos, total)
+           SELECT DATE(criado_em), forma_pagamento, status, status_pagamento,
+                  %s, %s * total
+           FROM pedidos WHERE id=%s
+           ON DUPLICATE KEY UPDATE pedidos = pedidos + VALUES(pedidos),
+                                   total   = total   + VALUES(total)""",
+        (sinal, sinal, pedido_id), fetch='none'
+    )
+
+
+def resumo_despesa(tx, despesa_id, sinal):
+    """Soma (sinal=+1) ou retira (sinal=-1) uma despesa do resumo diário."""
+    tx.query(
+        """INSERT INTO resumo_diario_despesas (dia, categoria, despesas, total)
+           SELECT data_despesa, categoria, %s, %s * valor
+           FROM despesas WHERE id=%s
+           ON DUPLICATE KEY UPDATE despesas = despesas + VALUES(despesas),
+                                   total    = total    + VALUES(total)""",
+        (sinal, sinal, despesa_id), fetch='none'
+    )
+
+
 @app.route('/api/admin/financeiro', methods=['GET'])
 @requer_admin
 def admin_financeiro():
-    import decimal
     data_ini = request.args.get('data_ini')
     data_fim = request.args.get('data_fim')
 
-    filtro_ped, filtro_desp = "", ""
-    params_ped, params_desp = [], []
-
+    where, params = [], []
     if data_ini:
-        filtro_ped  += " AND DATE(criado_em) >= %s";  params_ped.append(data_ini)
-        filtro_desp += " AND data_despesa   >= %s";   params_desp.append(data_ini)
+        where.append('dia >= %s'); params.append(data_ini)
     if data_fim:
-        filtro_ped  += " AND DATE(criado_em) <= %s";  params_ped.append(data_fim)
-        filtro_desp += " AND data_despesa   <= %s";   params_desp.append(data_fim)
-
-    # Receita confirmada (aprovado) e prevista (todos os pedidos)
-    receita_row, _ = query(
-        f"SELECT COALESCE(SUM(total),0) AS v FROM pedidos WHERE status_pagamento='aprovado' {filtro_ped}",
-        tuple(params_ped), fetch='one'
-    )
-    receita = float(receita_row['v'] if receita_row else 0)
-
-    receita_prev_row, _ = query(
-        f"SELECT COALESCE(SUM(total),0) AS v FROM pedidos WHERE status NOT IN ('cancelado','estornado') {filtro_ped}",
-        tuple(params_ped), fetch='one'
-    )
-    receita_prevista = float(receita_prev_row['v'] if receita_prev_row else 0)
-
-    despesa_row, _ = query(
-        f"SELECT COALESCE(SUM(valor),0) AS v FROM despesas WHERE 1=1 {filtro_desp}",
-        tuple(params_desp), fetch='one'
-    )
-    despesa = float(despesa_row['v'] if despesa_row else 0)
-
-    # Total de pedidos (todos exceto cancelados)
-    pedidos_row, _ = query(
-        f"SELECT COUNT(*) AS n FROM pedidos WHERE status NOT IN ('cancelado','estornado') {filtro_ped}",
-        tuple(params_ped), fetch='one'
-    )
-    total_pedidos = int(pedidos_row['n'] if pedidos_row else 0)
-    ticket_medio  = round(receita_prevista / total_pedidos, 2) if total_pedidos else 0
-
-    receita_mensal, _ = query(
-        f"""SELECT DATE_FORMAT(criado_em,'%%Y-%%m') AS mes,
-                   COALESCE(SUM(total),0)           AS receita,
-                   COUNT(*)                          AS pedidos
-            FROM pedidos WHERE status NOT IN ('cancelado','estornado') {filtro_ped}
-            GROUP BY mes ORDER BY mes ASC LIMIT 24""",
-        tuple(params_ped)
-    )
-
-    despesa_mensal, _ = query(
-        f"""SELECT DATE_FORMAT(data_despesa,'%%Y-%%m') AS mes,
-                   COALESCE(SUM(valor),0)              AS despesa
-            FROM despesas WHERE 1=1 {filtro_desp}
-            GROUP BY mes ORDER BY mes ASC LIMIT 24""",
-        tuple(params_desp)
-    )
+        where.append('dia <= %s'); params.append(data_fim)
+    clause = ('WHERE ' + ' AND '.join(where)) if where else ''
 
-    despesa_cat, _ = query(
-        f"""SELECT categoria, COALESCE(SUM(valor),0) AS total
-            FROM despesas WHERE 1=1 {filtro_desp}
-            GROUP BY categoria ORDER BY total DESC""",
-        tuple(params_desp)
+    # Dois round-trips, ambos sobre o resumo diário (agrupado por mês)
+    pedidos, _ = query(
+        f"""SELECT DATE_FORMAT(dia,'%%Y-%%m') AS mes, forma_pagamento,
+                   status, status_pagamento,
+                   SUM(pedidos) AS pedidos, SUM(total) AS total
+            FROM resumo_diario_pedidos {clause}
+            GROUP BY mes, forma_pagamento, status, status_pagamento""",
+        tuple(params)
     )
-
-    receita_forma, _ = query(
-        f"""SELECT forma_pagamento, COALESCE(SUM(total),0) AS total
-            FROM pedidos WHERE status_pagamento='aprovado' {filtro_ped}
-            GROUP BY forma_pagamento ORDER BY total DESC""",
-        tuple(params_ped)
+    despesas, _ = query(
+        f"""SELECT DATE_FORMAT(dia,'%%Y-%%m') AS mes, categoria,
+                   SUM(total) AS total
+            FROM resumo_diario_despesas {clause}
+            GROUP BY mes, categoria""",
+        tuple(params)
     )
 
-    def serializar(rows):
-        if not rows: return []
-        result = []
-        for r in rows:
-            row = {}
-            for k, v in r.items():
-                if isinstance(v, decimal.Decimal): row[k] = float(v)
-                else: row[k] = str(v) if not isinstance(v, (int, float, str, type(None), bool)) else v
-            result.append(row)
-        return result
+    receita = receita_prevista = despesa = 0.0
+    total_pedidos = 0
+    receita_mensal, receita_forma = {}, {}
+    despesa_mensal, despesa_cat = {}, {}
+
+    for r in (pedidos or []):
+        valor = float(r['total'] or 0)
+        n     = int(r['pedidos'] or 0)
+        if r['status_pagamento'] == 'aprovado':
+            receita += valor
+            receita_forma[r['forma_pagamento']] = receita_forma.get(r['forma_pagamento'], 0.0) + valor
+        if r['status'] not in ('cancelado', 'estornado'):
+            receita_prevista += valor
+            total_pedidos    += n
+            mes = receita_mensal.setdefault(r['mes'], {'mes': r['mes'], 'receita': 0.0, 'pedidos': 0})
+            mes['receita'] += valor
+            mes['pedidos'] += n
+
+    for r in (despesas or []):
+        valor = float(r['total'] or 0)
+        despesa += valor
+        despesa_mensal[r['mes']] = despesa_mensal.get(r['mes'], 0.0) + valor
+        despesa_cat[r['categoria']] = despesa_cat.get(r['categoria'], 0.0) + valor
+
+    ticket_medio = round(receita_prevista / total_pedidos, 2) if total_pedidos else 0
 
     return ok({
         'kpis': {
-            'receita':          receita,
-            'receita_prevista': receita_prevista,
-            'despesa':          despesa,
+            'receita':          round(receita, 2),
+            'receita_prevista': round(receita_prevista, 2),
+            'despesa':          round(despesa, 2),
             'lucro':            round(receita - despesa, 2),
             'lucro_previsto':   round(receita_prevista - despesa, 2),
             'total_pedidos':    total_pedidos,
             'ticket_medio':     ticket_medio,
         },
-        'receita_mensal': serializar(receita_mensal),
-        'despesa_mensal': serializar(despesa_mensal),
-        'despesa_cat':    serializar(despesa_cat),
-        'receita_forma':  serializar(receita_forma),
+        'receita_mensal': [dict(m, receita=round(m['receita'], 2))
+                           for _, m in sorted(receita_mensal.items())][:24],
+        'despesa_mensal': [{'mes': mes, 'despesa': round(v, 2)}
+                           for mes, v in sorted(despesa_mensal.items())][:24],
+        'despesa_cat':    [{'categoria': c, 'total': round(v, 2)}
+                           for c, v in sorted(despesa_cat.items(), key=lambda x: -x[1])],
+        'receita_forma':  [{'forma_pagamento': f, 'total': round(v, 2)}
+                           for f, v in sorted(receita_forma.items(), key=lambda x: -x[1])],
     })
 
 
@@ -1472,16 +3511,12 @@ def admin_get_config_pagamento():
 @app.route('/api/admin/config-pagamento', methods=['PUT'])
 @requer_admin
 def admin_set_config_pagamento():
-    d = request.get_json() or {}
-    for chave, valor in d.items():
-        if chave not in PAYMENT_KEYS:
-            continue
-        query(
-            "INSERT INTO configuracoes (chave, valor) VALUES (%s,%s) "
-            "ON DUPLICATE KEY UPDATE valor=%s",
-            (chave, valor, valor), fetch='none'
-        )
-    return ok(msg='Configuracoes de pagamento salvas!')
+    try:
+        valores = validar_configuracoes(request.get_json(silent=True), PAYMENT_KEYS)
+    except ValueError as e:
+        return err(str(e))
+    alteradas = salvar_configuracoes(valores)
+    return ok({'alteradas': alteradas}, 'Configuracoes de pagamento salvas!')
 
 if __name__ == '__main__':
     print('=' * 60)
@@ -1489,14 +3524,14 @@ if __name__ == '__main__':
     print('=' * 60)
     print(f'  DB Host : {DB_CONFIG["host"]}:{DB_CONFIG["port"]}')
     print(f'  DB Name : {DB_CONFIG["database"]}')
+    print(f'  DB Pool : até {DB_POOL_MAX} conexões por worker')
     print(f'  JWT     : {"ativo" if JWT_DISPONIVEL else "inativo (instale PyJWT)"}')
     print('=' * 60)
 
     # Testa a conexão ao iniciar
     try:
-        conn = get_db()
-        conn.ping()
-        conn.close()
+        with get_db() as conn:
+            conn.ping()
         print('  ✅ Banco de dados conectado com sucesso!')
     except Exception as e:
         print(f'  ❌ Erro ao conectar ao banco: {e}')
@@ -167,6 +167,12 @@
             return api.get(`/api/produtos${qs ? '?' + qs : ''}`);
         },
         detalhe: (id) => api.get(`/api/produtos/${id}`),
+        // Próxima página de avaliações: `after` = avaliacoes_proximo / proximo
+        avaliacoes: (id, after) =>
+            api.get(`/api/produtos/${id}/avaliacoes${after ? '?after=' + encodeURIComponent(after) : ''}`),
+
+        // Sabores de vários produtos numa chamada: { produto_id: [sabores] }
+        sabores: (ids) => api.get(`/api/produtos/sabores?ids=${ids.join(',')}`),
     };
 
     api.pedidos = {
@@ -182,8 +188,13 @@
     };
 
     api.cupons = {
-        validar: (codigo, total) =>
-            api.post('/api/cupons/validar', { codigo, total }),
+        validar: (codigo, carrinho) =>
+            api.post('/api/cupons/validar', { codigo, carrinho }),
+    };
+
+    api.carrinho = {
+        cotacao: (carrinho, cupom) =>
+            api.post('/api/carrinho/cotacao', { carrinho, cupom }),
     };
 
     /* -------------------------------------------------------
@@ -161,15 +161,28 @@ window.addEventListener('templateCarregado', () => {
 });
 
 
+// Imagem do card: WebP via <picture> para quem suporta, JPEG/original para o resto
+const IMAGEM_SIZES = '(max-width: 600px) 50vw, 320px';
+function imagemProduto(produto) {
+    const original = produto.imagem_principal || produto.imagem || '';
+    const img = (srcset) => `<img src="${original}" ${srcset ? `srcset="${srcset}" sizes="${IMAGEM_SIZES}"` : ''}
+                     alt="${produto.nome}" loading="lazy"
+                     onerror="this.src='https://images.unsplash.com/photo-1548907040-4baa42d10919?w=600';this.onerror=null;">`;
+    const variantes = produto.imagem_srcset;
+    if (!variantes) return img('');
+    return `<picture>
+                    ${variantes.webp ? `<source type="image/webp" srcset="${variantes.webp}" sizes="${IMAGEM_SIZES}">` : ''}
+                    ${img(variantes.jpeg)}
+                </picture>`;
+}
+
 // Renderizar produtos
 function renderProdutos() {
     const grid = document.getElementById('produtosGrid');
     grid.innerHTML = produtos.map(produto => `
         <div class="produto-card" data-id="${produto.id}">
             <div class="produto-image">
-                <img src="${produto.imagem_principal || produto.imagem || ''}"
-                     alt="${produto.nome}"
-                     onerror="this.src='https://images.unsplash.com/photo-1548907040-4baa42d10919?w=600';this.onerror=null;">
+                ${imagemProduto(produto)}
                 ${produto.badge ? `<span class="produto-badge">${produto.badge}</span>` : ''}
                 <button class="btn-desejo ${desejosSet.has(produto.id) ? 'ativo' : ''}"
                         data-id="${produto.id}"
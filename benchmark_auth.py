@@ -0,0 +1,142 @@
+"""
+================================================================
+  SPINASSI CHOCOLATES — Microbenchmark da autenticação
+  Mede o custo por requisição de verificar_token() (usado por
+  requer_login / requer_admin) sem e com o cache de tokens
+  verificados, e a latência de logins legítimos completos durante
+  uma rajada de tentativas vindas de um único IP.
+
+  Uso:
+      python benchmark_auth.py [iterações]
+================================================================
+"""
+
+import os
+import sys
+import time
+import threading
+
+# As requisições simulam o proxy de produção (X-Forwarded-For)
+os.environ.setdefault("PROXY_HOPS", "1")
+
+import app as backend
+
+
+def medir(token, iteracoes, com_cache):
+    cache = backend.TOKENS_VERIFICADOS
+    cache.limpar()
+    maximo, cache.maximo = cache.maximo, (cache.maximo if com_cache else 0)
+    try:
+        backend.verificar_token(token)          # aquece
+        inicio = time.perf_counter()
+        for _ in range(iteracoes):
+            backend.verificar_token(token)
+        return (time.perf_counter() - inicio) / iteracoes * 1e6
+    finally:
+        cache.maximo = maximo
+        cache.limpar()
+
+
+def percentil(amostras, p):
+    amostras = sorted(amostras)
+    return amostras[min(len(amostras) - 1, int(len(amostras) * p))]
+
+
+def carga_login(segundos=3, atacantes=8):
+    """
+    Atacantes martelam /api/auth/login de um único IP (recusados com 429
+    antes de tocar o banco) enquanto clientes legítimos, cada um com seu
+    IP e e-mail, fazem o login completo: limitadores, consulta do usuário,
+    verificação do hash e emissão do token. Todas as requisições chegam
+    pelo mesmo proxy com X-Forwarded-For, como em produção.
+    O banco é trocado por um usuário fixo em memória para que a medição
+    reflita só o custo do app (não a latência de rede até o MySQL).
+    """
+    cliente = backend.app.test_client()
+    proxy = {"REMOTE_ADDR": "172.17.0.1"}
+    usuario = {"id": 1, "nome": "Cliente", "sobrenome": "Teste", "tipo": "cliente", "ativo": 1,
+               "senha_hash": backend.generate_password_hash("senha-legitima", backend.SENHA_METODO)}
+    backend.query = lambda sql, args=None, fetch="all": (usuario, None)
+    backend.log = lambda *args, **kwargs: None
+
+    # Limitador com reposição desprezível: o balde do atacante não volta a
+    # encher durante a medição e nenhuma tentativa chega ao banco
+    backend.LOGIN_POR_IP = backend.LimitadorTaxa("login_ip", backend.LIMITE_LOGIN_IP[0], 1e-6)
+    while not backend.LOGIN_POR_IP.consumir("203.0.113.7"):
+        pass
+
+    proximo = iter(range(1 << 30))
+
+    def legitimos(n):
+        tempos = []
+        for _ in range(n):
+            i = next(proximo)
+            ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+            inicio = time.perf_counter()
+            r = cliente.post("/api/auth/login",
+                             json={"email": f"cliente{i}@exemplo.com", "senha": "senha-legitima"},
+                             headers={"X-Forwarded-For": ip}, environ_base=proxy)
+            tempos.append((time.perf_counter() - inicio) * 1e3)
+            assert r.status_code == 200, r.get_json()
+        return tempos
+
+    base = legitimos(30)
+
+    parar = threading.Event()
+    recusas, tempos_429 = [0], []
+
+    def atacar():
+        corpo = {"email": "ataque@exemplo.com", "senha": "x" * 8}
+        while not parar.is_set():
+            inicio = time.perf_counter()
+            r = cliente.post("/api/auth/login", json=corpo,
+                             headers={"X-Forwarded-For": "203.0.113.7"}, environ_base=proxy)
+            tempos_429.append((time.perf_counter() - inicio) * 1e3)
+            recusas[0] += r.status_code == 429
+
+    threads = [threading.Thread(target=atacar) for _ in range(atacantes)]
+    for t in threads:
+        t.start()
+    sob_ataque = []
+    try:
+        fim = time.time() + segundos
+        while time.time() < fim:
+            sob_ataque += legitimos(5)
+    finally:
+        parar.set()
+        for t in threads:
+            t.join()
+
+    print(f"  POST /api/auth/login sob ataque — {atacantes} threads por {segundos}s")
+    print("─" * 60)
+    print(f"  Legítimo, sem ataque : p50 {percentil(base, .5):7.2f} ms   "
+          f"p99 {percentil(base, .99):7.2f} ms")
+    print(f"  Legítimo, sob ataque : p50 {percentil(sob_ataque, .5):7.2f} ms   "
+          f"p99 {percentil(sob_ataque, .99):7.2f} ms   ({len(sob_ataque)} logins)")
+    print(f"  Resposta 429         : p50 {percentil(tempos_429, .5):7.2f} ms   "
+          f"({recusas[0]} de {len(tempos_429)} recusadas)")
+    print("═" * 60)
+
+
+def main():
+    iteracoes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if not backend.JWT_DISPONIVEL:
+        print("  ❌  PyJWT não instalado")
+        sys.exit(1)
+
+    token = backend.gerar_token(1, "cliente")
+    sem = medir(token, iteracoes, com_cache=False)
+    com = medir(token, iteracoes, com_cache=True)
+
+    print("═" * 60)
+    print(f"  verificar_token() — {iteracoes} iterações")
+    print("─" * 60)
+    print(f"  Sem cache : {sem:8.2f} µs/requisição")
+    print(f"  Com cache : {com:8.2f} µs/requisição")
+    print(f"  Ganho     : {sem / com:8.1f}x")
+    print("═" * 60)
+    carga_login()
+
+
+if __name__ == "__main__":
+    main()
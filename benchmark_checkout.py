@@ -0,0 +1,193 @@
+"""
+================================================================
+  SPINASSI CHOCOLATES — Carga concorrente no checkout
+  Dispara N chamadas simultâneas de POST /api/pedidos contra
+  poucos produtos compartilhados (o "ovo de Páscoa esgotando")
+  e confere, no banco, que a reserva de estoque aguentou:
+
+    • nenhum estoque final negativo;
+    • unidades vendidas = soma dos itens dos pedidos aceitos
+      (pela resposta e por pedido_itens);
+    • deadlocks / lock wait timeouts contados e re-tentados.
+
+  Cria produtos próprios (slug bench-checkout-*) e apaga tudo o
+  que gerou ao final — pedidos, itens, resumo diário e produtos.
+  Rode contra um banco de homologação.
+
+  Uso:
+      python benchmark_checkout.py [pedidos] [produtos] [estoque]
+      (padrão: 200 pedidos, 3 produtos, estoque 150 cada)
+================================================================
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Pool grande: a disputa tem de acontecer no InnoDB, não na fila do pool.
+# (100 fica abaixo do max_connections padrão do MySQL, 151)
+os.environ.setdefault("DB_POOL_MAX", "100")
+os.environ.setdefault("DB_POOL_TIMEOUT", "60")
+
+import pymysql
+
+import app as backend
+
+ERROS_DE_TRAVA = {1213: "deadlocks", 1205: "lock_wait_timeouts"}
+MAX_TENTATIVAS = 5
+
+
+def percentil(amostras, p):
+    amostras = sorted(amostras)
+    return amostras[min(len(amostras) - 1, int(len(amostras) * p))] if amostras else 0.0
+
+
+def criar_produtos(qtd, estoque):
+    prefixo = f"bench-checkout-{uuid.uuid4().hex[:8]}"
+    ids = []
+    with backend.transaction() as tx:
+        for i in range(qtd):
+            _, pid = tx.query(
+                """INSERT INTO produtos (nome, slug, preco, estoque, ativo)
+                   VALUES (%s, %s, %s, %s, 1)""",
+                (f"Benchmark checkout {i + 1}", f"{prefixo}-{i + 1}", 10.00 + i, estoque),
+                fetch="none"
+            )
+            ids.append(pid)
+    return ids
+
+
+def limpar(produtos, pedidos):
+    with backend.transaction() as tx:
+        for ped_id in pedidos:
+            backend.resumo_pedido(tx, ped_id, -1)
+        if pedidos:
+            tx.query(f"DELETE FROM pedidos WHERE id IN ({','.join(['%s'] * len(pedidos))})",
+                     tuple(pedidos), fetch="none")
+        tx.query(f"DELETE FROM produtos WHERE id IN ({','.join(['%s'] * len(produtos))})",
+                 tuple(produtos), fetch="none")
+    backend.CATALOGO.invalidar()
+
+
+def carga(pedidos, produtos, estoque):
+    backend.app.testing = True          # exceções do banco chegam aqui, não como 500
+    cliente = backend.app.test_client()
+    ids = criar_produtos(produtos, estoque)
+    sorteio = random.Random(42)
+    # Carrinhos com os produtos em ordem aleatória: a trava em ordem de id
+    # é que precisa evitar o deadlock, não a ordem em que o cliente mandou
+    carrinhos = [
+        [{"id": pid, "quantidade": sorteio.randint(1, 3)}
+         for pid in sorteio.sample(ids, sorteio.randint(1, len(ids)))]
+        for _ in range(pedidos)
+    ]
+
+    largada = threading.Barrier(pedidos)
+    contadores = {"deadlocks": 0, "lock_wait_timeouts": 0, "retentativas": 0, "erros": 0}
+    trava_contadores = threading.Lock()
+    criados = []                        # pedidos gravados, para a limpeza
+
+    def checkout(i):
+        corpo = {"carrinho": carrinhos[i],
+                 "cliente": {"nome": f"Carga {i}", "email": f"carga{i}@exemplo.com"}}
+        largada.wait()
+        inicio = time.perf_counter()
+        for tentativa in range(MAX_TENTATIVAS):
+            try:
+                r = cliente.post("/api/pedidos", json=corpo)
+                if r.status_code == 201:
+                    with trava_contadores:
+                        criados.append(r.get_json()["data"]["pedido_id"])
+                return r.status_code, r.get_json(), (time.perf_counter() - inicio) * 1e3
+            except pymysql.err.OperationalError as e:
+                tipo = ERROS_DE_TRAVA.get(e.args[0])
+                if not tipo:
+                    raise
+                with trava_contadores:
+                    contadores[tipo] += 1
+                    if tentativa + 1 < MAX_TENTATIVAS:
+                        contadores["retentativas"] += 1
+                time.sleep(0.01 * 2 ** tentativa)
+        with trava_contadores:
+            contadores["erros"] += 1
+        return None, None, (time.perf_counter() - inicio) * 1e3
+
+    aceitos, recusados, outros = [], 0, 0
+    latencias = []
+    inicio = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=pedidos) as pool:
+            resultados = list(pool.map(checkout, range(pedidos)))
+        duracao = time.perf_counter() - inicio
+
+        for i, (status, corpo, ms) in enumerate(resultados):
+            latencias.append(ms)
+            if status == 201:
+                aceitos.append((corpo["data"]["pedido_id"], carrinhos[i]))
+            elif status == 409:
+                recusados += 1
+            else:
+                outros += 1
+
+        # ── Conferência no banco ─────────────────────────────
+        marcadores = ",".join(["%s"] * len(ids))
+        finais, _ = backend.query(f"SELECT id, estoque FROM produtos WHERE id IN ({marcadores})",
+                                  tuple(ids))
+        final = {r["id"]: r["estoque"] for r in finais}
+        gravados = {}
+        if aceitos:
+            ped_ids = [p for p, _ in aceitos]
+            rows, _ = backend.query(
+                f"""SELECT produto_id, SUM(quantidade) AS qtd FROM pedido_itens
+                    WHERE pedido_id IN ({','.join(['%s'] * len(ped_ids))})
+                    GROUP BY produto_id""",
+                tuple(ped_ids)
+            )
+            gravados = {r["produto_id"]: int(r["qtd"]) for r in rows}
+        pela_resposta = {pid: 0 for pid in ids}
+        for _, carrinho in aceitos:
+            for item in carrinho:
+                pela_resposta[item["id"]] += item["quantidade"]
+
+        print("═" * 60)
+        print(f"  Checkout concorrente — {pedidos} pedidos, {produtos} produto(s), "
+              f"estoque {estoque} cada")
+        print("─" * 60)
+        print(f"  Aceitos (201)   : {len(aceitos)}")
+        print(f"  Recusados (409) : {recusados}")
+        print(f"  Outros          : {outros}   (desistiram após {MAX_TENTATIVAS} "
+              f"tentativas: {contadores['erros']})")
+        print(f"  Deadlocks       : {contadores['deadlocks']}   lock wait timeouts: "
+              f"{contadores['lock_wait_timeouts']}   retentativas: {contadores['retentativas']}")
+        print(f"  Vazão           : {pedidos / duracao:8.1f} checkouts/s   ({duracao:.2f}s)")
+        print(f"  Latência        : p50 {percentil(latencias, .5):7.1f} ms   "
+              f"p99 {percentil(latencias, .99):7.1f} ms")
+        print("─" * 60)
+
+        ok = True
+        for pid in ids:
+            vendido = estoque - final[pid]
+            certo = final[pid] >= 0 and vendido == pela_resposta[pid] == gravados.get(pid, 0)
+            ok &= certo
+            print(f"  {'✅' if certo else '❌'}  produto {pid}: estoque final {final[pid]:>4}   "
+                  f"vendido {vendido:>4}   pedidos aceitos {pela_resposta[pid]:>4}   "
+                  f"pedido_itens {gravados.get(pid, 0):>4}")
+        print("═" * 60)
+        return ok
+    finally:
+        limpar(ids, criados)
+
+
+def main():
+    pedidos  = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    produtos = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    estoque  = int(sys.argv[3]) if len(sys.argv) > 3 else 150
+    return 0 if carga(pedidos, produtos, estoque) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
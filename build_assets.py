@@ -0,0 +1,148 @@
+"""
+================================================================
+  SPINASSI CHOCOLATES — Build dos assets estáticos
+  Minifica e carimba com o hash do conteúdo tudo que está em
+  assets/css e assets/js, grava as versões .gz/.br ao lado e o
+  manifesto que os templates usam (função asset() no Jinja).
+
+  Uso:
+      python build_assets.py             (exige rjsmin e brotli)
+      python build_assets.py --parcial   (sem eles: JS sem minificar, sem .br)
+
+  Dependências (já no requirements.txt):
+      pip install rjsmin brotli
+================================================================
+"""
+
+import os
+import re
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ── Caminhos ─────────────────────────────────────────────────
+RAIZ       = os.path.dirname(os.path.abspath(__file__))
+ORIGENS    = ("css", "js")                       # subpastas de assets/
+DESTINO    = os.path.join(RAIZ, "assets", "dist")
+MANIFESTO  = os.path.join(DESTINO, "manifest.json")
+TAM_HASH   = 10                                  # caracteres do hash no nome
+
+# Strings e comentários de CSS (strings ficam intactas, comentários saem)
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+def minificar_css(texto):
+    """
+    Remove comentários e espaços redundantes sem tocar no conteúdo de
+    strings (data URIs, content:). Não mexe em espaços antes de ':'
+    (seletores como 'div :hover') nem em '+'/'-' (calc()).
+    """
+    partes = []
+    pos = 0
+    for m in _CSS_TOKENS.finditer(texto):
+        partes.append(_espremer_css(texto[pos:m.start()]))
+        if m.group(1):
+            partes.append(m.group(1))
+        pos = m.end()
+    partes.append(_espremer_css(texto[pos:]))
+    return "".join(partes).strip() + "\n"
+
+
+def _espremer_css(trecho):
+    trecho = re.sub(r"\s+", " ", trecho)
+    trecho = re.sub(r"\s*([{};,])\s*", r"\1", trecho)
+    trecho = re.sub(r":\s+", ":", trecho)
+    return trecho.replace(";}", "}")
+
+
+def minificar_js(texto):
+    # Sem um minificador de verdade o JS sai como está: regex em JS
+    # quebra strings, template literals e expressões regulares.
+    return rjsmin.jsmin(texto) + "\n" if rjsmin else texto
+
+
+MINIFICADORES = {".css": minificar_css, ".js": minificar_js}
+
+
+def gravar_comprimidos(caminho, dados):
+    """Grava .gz (sempre) e .br (se o brotli estiver instalado) quando compensam."""
+    gz = gzip.compress(dados, compresslevel=9, mtime=0)
+    if len(gz) < len(dados):
+        with open(caminho + ".gz", "wb") as f:
+            f.write(gz)
+    if brotli:
+        br = brotli.compress(dados, quality=11)
+        if len(br) < len(dados):
+            with open(caminho + ".br", "wb") as f:
+                f.write(br)
+
+
+def faltando():
+    """Pacotes de otimização ausentes neste ambiente."""
+    return [nome for nome, mod in (("rjsmin", rjsmin), ("brotli", brotli)) if mod is None]
+
+
+def main():
+    ausentes = faltando()
+    if ausentes and "--parcial" not in sys.argv[1:]:
+        print(f"  ❌  Não instalado(s): {', '.join(ausentes)} — sem isso o JS sai sem "
+              "minificar e/ou sem versões .br.\n"
+              "      Rode 'pip install -r requirements.txt' ou use --parcial "
+              "para gerar assim mesmo.", file=sys.stderr)
+        return 1
+
+    if os.path.isdir(DESTINO):
+        shutil.rmtree(DESTINO)
+    manifesto = {}
+    total_antes = total_depois = 0
+
+    for pasta in ORIGENS:
+        origem = os.path.join(RAIZ, "assets", pasta)
+        os.makedirs(os.path.join(DESTINO, pasta), exist_ok=True)
+        for nome in sorted(os.listdir(origem)):
+            base, ext = os.path.splitext(nome)
+            if ext not in MINIFICADORES:
+                continue
+            with open(os.path.join(origem, nome), encoding="utf-8") as f:
+                fonte = f.read()
+            dados = MINIFICADORES[ext](fonte).encode("utf-8")
+            carimbo = hashlib.sha256(dados).hexdigest()[:TAM_HASH]
+            final = f"{base}.{carimbo}{ext}"
+            caminho = os.path.join(DESTINO, pasta, final)
+            with open(caminho, "wb") as f:
+                f.write(dados)
+            gravar_comprimidos(caminho, dados)
+
+            manifesto[f"{pasta}/{nome}"] = f"dist/{pasta}/{final}"
+            antes, depois = len(fonte.encode("utf-8")), len(dados)
+            total_antes += antes
+            total_depois += depois
+            print(f"  ✅  {pasta}/{nome:<16} {antes:>7} → {depois:>7} bytes  ({final})")
+
+    with open(MANIFESTO, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, indent=2, sort_keys=True)
+
+    print("─" * 60)
+    print(f"  {len(manifesto)} arquivos   {total_antes} → {total_depois} bytes")
+    if not rjsmin:
+        print("  ⚠  BUILD PARCIAL: rjsmin não instalado — JS copiado sem minificar",
+              file=sys.stderr)
+    if not brotli:
+        print("  ⚠  BUILD PARCIAL: brotli não instalado — só versões .gz", file=sys.stderr)
+    print(f"  Manifesto: {os.path.relpath(MANIFESTO, RAIZ)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
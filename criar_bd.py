@@ -7,6 +7,7 @@
   Uso:
       pip install pymysql cryptography werkzeug
       python criar_banco.py
+      python criar_bd.py <comando>   (reconstruir-financeiro | reconstruir-avaliacoes | manutencao)
 ================================================================
 """
 
@@ -14,6 +15,12 @@ import sys
 import pymysql
 from datetime import datetime
 
+# Manutenção (python <este arquivo> <comando>) é compartilhada com o outro script
+from manutencao_bd import (
+    executar_comando, particionar_log_atividades,
+    reconstruir_avaliacoes, reconstruir_resumo_financeiro,
+)
+
 try:
     from werkzeug.security import generate_password_hash
 except ImportError:
@@ -67,7 +74,8 @@ CREATE TABLE IF NOT EXISTS usuarios (
     UNIQUE KEY uq_email (email),
     UNIQUE KEY uq_cpf   (cpf),
     INDEX idx_tipo  (tipo),
-    INDEX idx_ativo (ativo)
+    INDEX idx_ativo (ativo),
+    INDEX idx_criado (criado_em, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
@@ -83,6 +91,7 @@ CREATE TABLE IF NOT EXISTS recuperacao_senha (
     PRIMARY KEY (id),
     UNIQUE KEY uq_token (token),
     INDEX idx_usuario (usuario_id),
+    INDEX idx_expira  (expira_em),
     CONSTRAINT fk_rec_usuario
         FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
@@ -130,6 +139,8 @@ CREATE TABLE IF NOT EXISTS categorias (
 """
 
 # ── 05. Produtos ─────────────────────────────────────────────
+# nota_media, total_avaliacoes e avaliacoes_1..5 (histograma) são mantidos
+# pelo app ao aprovar avaliações. Reconstrução: reconstruir-avaliacoes.
 TABELAS["produtos"] = """
 CREATE TABLE IF NOT EXISTS produtos (
     id                  INT UNSIGNED  NOT NULL AUTO_INCREMENT,
@@ -146,6 +157,13 @@ CREATE TABLE IF NOT EXISTS produtos (
     peso_gramas         INT UNSIGNED  DEFAULT NULL,
     ativo               TINYINT(1)    NOT NULL DEFAULT 1,
     destaque            TINYINT(1)    NOT NULL DEFAULT 0,
+    nota_media          DECIMAL(3,2)  NOT NULL DEFAULT 0.00,
+    total_avaliacoes    INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_1        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_2        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_3        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_4        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_5        INT UNSIGNED  NOT NULL DEFAULT 0,
     criado_em           DATETIME      NOT NULL DEFAULT CURRENT_TIMESTAMP,
     atualizado_em       DATETIME      NOT NULL DEFAULT CURRENT_TIMESTAMP
                                       ON UPDATE CURRENT_TIMESTAMP,
@@ -154,6 +172,7 @@ CREATE TABLE IF NOT EXISTS produtos (
     INDEX idx_categoria (categoria_id),
     INDEX idx_ativo     (ativo),
     INDEX idx_destaque  (destaque),
+    INDEX idx_vitrine   (ativo, destaque, id),
     CONSTRAINT fk_prod_categoria
         FOREIGN KEY (categoria_id) REFERENCES categorias(id) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
@@ -257,6 +276,7 @@ CREATE TABLE IF NOT EXISTS pedidos (
     INDEX idx_usuario (usuario_id),
     INDEX idx_status  (status),
     INDEX idx_criado  (criado_em),
+    INDEX idx_status_criado (status, criado_em, id),
     CONSTRAINT fk_ped_usuario
         FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE SET NULL,
     CONSTRAINT fk_ped_cupom
@@ -320,6 +340,8 @@ CREATE TABLE IF NOT EXISTS avaliacoes (
     PRIMARY KEY (id),
     INDEX idx_produto  (produto_id),
     INDEX idx_aprovada (aprovada),
+    INDEX idx_criado   (criado_em, id),
+    INDEX idx_produto_aprovada (produto_id, aprovada, criado_em, id),
     CONSTRAINT chk_nota CHECK (nota BETWEEN 1 AND 5),
     CONSTRAINT fk_av_produto
         FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE,
@@ -340,7 +362,8 @@ CREATE TABLE IF NOT EXISTS contatos (
     respondida  TINYINT(1)   NOT NULL DEFAULT 0,
     criado_em   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (id),
-    INDEX idx_lida (lida)
+    INDEX idx_lida   (lida),
+    INDEX idx_criado (criado_em, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
@@ -355,7 +378,8 @@ CREATE TABLE IF NOT EXISTS configuracoes (
 """
 
 # ── 15. Log de atividades ────────────────────────────────────
-TABELAS["log_atividades", "despesas"] = """
+# Particionada por mês; retenção via: python criar_bd.py manutencao
+TABELAS["log_atividades"] = """
 CREATE TABLE IF NOT EXISTS log_atividades (
     id          INT UNSIGNED NOT NULL AUTO_INCREMENT,
     usuario_id  INT UNSIGNED DEFAULT NULL,
@@ -363,10 +387,13 @@ CREATE TABLE IF NOT EXISTS log_atividades (
     descricao   TEXT         DEFAULT NULL,
     ip          VARCHAR(45)  DEFAULT NULL,
     criado_em   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    PRIMARY KEY (id),
-    INDEX idx_usuario (usuario_id),
-    INDEX idx_criado  (criado_em)
+    PRIMARY KEY (id, criado_em),
+    INDEX idx_log_usuario (usuario_id),
+    INDEX idx_log_criado  (criado_em)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE COLUMNS (criado_em) (
+    PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+)
 """
 
 
@@ -403,6 +430,108 @@ CREATE TABLE IF NOT EXISTS despesas (
 
 
 
+# ── 16. Resumo financeiro diário (mantido pelo app) ──────────
+# Um registro por dia × forma de pagamento × status; lido pelo
+# /api/admin/financeiro. Reconstrução: reconstruir-financeiro.
+TABELAS["resumo_diario_pedidos"] = """
+CREATE TABLE IF NOT EXISTS resumo_diario_pedidos (
+    dia              DATE          NOT NULL,
+    forma_pagamento  VARCHAR(20)   NOT NULL,
+    status           VARCHAR(30)   NOT NULL,
+    status_pagamento VARCHAR(20)   NOT NULL,
+    pedidos          INT           NOT NULL DEFAULT 0,
+    total            DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (dia, forma_pagamento, status, status_pagamento)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+TABELAS["resumo_diario_despesas"] = """
+CREATE TABLE IF NOT EXISTS resumo_diario_despesas (
+    dia        DATE          NOT NULL,
+    categoria  VARCHAR(30)   NOT NULL,
+    despesas   INT           NOT NULL DEFAULT 0,
+    total      DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (dia, categoria)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# ── 17. Fila de e-mails (outbox) ──────────────────────────────
+# Gravada pelas rotas; enviada em segundo plano pelo app.
+TABELAS["email_fila"] = """
+CREATE TABLE IF NOT EXISTS email_fila (
+    id                INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    destinatario      VARCHAR(150) NOT NULL,
+    assunto           VARCHAR(200) NOT NULL,
+    html              MEDIUMTEXT   NOT NULL,
+    status            ENUM('pendente','enviando','enviado','falhou')
+                      NOT NULL DEFAULT 'pendente',
+    tentativas        INT UNSIGNED NOT NULL DEFAULT 0,
+    ultimo_erro       VARCHAR(500) DEFAULT NULL,
+    proxima_tentativa DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    enviado_em        DATETIME     DEFAULT NULL,
+    criado_em         DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    atualizado_em     DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+                                   ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    INDEX idx_fila (status, proxima_tentativa)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# ================================================================
+#  ÍNDICES E COLUNAS ADICIONAIS
+#  CREATE TABLE IF NOT EXISTS não altera tabelas antigas: estes
+#  índices e colunas são adicionados à parte quando ainda não existem.
+# ================================================================
+
+# (tabela, nome do índice, colunas)
+INDICES = [
+    ("usuarios",          "idx_criado",           "criado_em, id"),
+    ("produtos",          "idx_vitrine",          "ativo, destaque, id"),
+    ("pedidos",           "idx_status_criado",    "status, criado_em, id"),
+    ("avaliacoes",        "idx_criado",           "criado_em, id"),
+    ("avaliacoes",        "idx_produto_aprovada", "produto_id, aprovada, criado_em, id"),
+    ("contatos",          "idx_criado",           "criado_em, id"),
+    ("recuperacao_senha", "idx_expira",           "expira_em"),
+]
+
+
+def criar_indices(cur):
+    for tabela, nome, colunas in INDICES:
+        cur.execute(
+            """SELECT 1 FROM information_schema.statistics
+               WHERE table_schema = DATABASE()
+                 AND table_name = %s AND index_name = %s
+               LIMIT 1""",
+            (tabela, nome)
+        )
+        if cur.fetchone():
+            continue
+        cur.execute(f"ALTER TABLE `{tabela}` ADD INDEX `{nome}` ({colunas})")
+        print(f"  ✔  {tabela}.{nome}  ← índice criado")
+
+
+# (tabela, coluna, definição) — agregados de avaliações em produtos
+COLUNAS = [
+    ("produtos", "nota_media",       "DECIMAL(3,2) NOT NULL DEFAULT 0.00"),
+    ("produtos", "total_avaliacoes", "INT UNSIGNED NOT NULL DEFAULT 0"),
+] + [("produtos", f"avaliacoes_{n}", "INT UNSIGNED NOT NULL DEFAULT 0") for n in range(1, 6)]
+
+
+def criar_colunas(cur):
+    for tabela, coluna, definicao in COLUNAS:
+        cur.execute(
+            """SELECT 1 FROM information_schema.columns
+               WHERE table_schema = DATABASE()
+                 AND table_name = %s AND column_name = %s
+               LIMIT 1""",
+            (tabela, coluna)
+        )
+        if cur.fetchone():
+            continue
+        cur.execute(f"ALTER TABLE `{tabela}` ADD COLUMN `{coluna}` {definicao}")
+        print(f"  ✔  {tabela}.{coluna}  ← coluna criada")
+
+
 # ================================================================
 #  DADOS INICIAIS
 # ================================================================
@@ -670,11 +799,18 @@ def main():
             except pymysql.Error as e:
                 print(f"  ❌  {nome_tab}: {e}")
                 raise
+        criar_colunas(cur)
+        criar_indices(cur)
+        particionar_log_atividades(cur)
+        conn.commit()
 
         # ── Insere dados iniciais ─────────────────────────────
         print("\n[3/4] Inserindo dados iniciais...")
         inserir_dados_iniciais(cur)
         conn.commit()
+        reconstruir_resumo_financeiro(cur)
+        reconstruir_avaliacoes(cur)
+        conn.commit()
 
         # ── Reativa FK ───────────────────────────────────────
         cur.execute("SET FOREIGN_KEY_CHECKS = 1")
@@ -714,4 +850,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        executar_comando(sys.argv[1], DB)
+    else:
+        main()
\ No newline at end of file
@@ -11,12 +11,13 @@
   │                                                         │
   │  SEÇÃO 2 — ADMIN       → DROP + CREATE                  │
   │  Sempre recria as tabelas administrativas.              │
-  │  (despesas, log_atividades)                             │
+  │  (despesas)                                             │
   └─────────────────────────────────────────────────────────┘
 
   Uso:
       pip install pymysql cryptography werkzeug
       python criar_banco.py
+      python criar_bd_admin.py <comando>   (reconstruir-financeiro | reconstruir-avaliacoes | manutencao)
 ================================================================
 """
 
@@ -24,6 +25,12 @@ import sys
 import pymysql
 from datetime import datetime
 
+# Manutenção (python <este arquivo> <comando>) é compartilhada com o outro script
+from manutencao_bd import (
+    executar_comando, particionar_log_atividades,
+    reconstruir_avaliacoes, reconstruir_resumo_financeiro,
+)
+
 try:
     from werkzeug.security import generate_password_hash
 except ImportError:
@@ -79,7 +86,8 @@ CREATE TABLE IF NOT EXISTS usuarios (
     UNIQUE KEY uq_email (email),
     UNIQUE KEY uq_cpf   (cpf),
     INDEX idx_tipo  (tipo),
-    INDEX idx_ativo (ativo)
+    INDEX idx_ativo (ativo),
+    INDEX idx_criado (criado_em, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
@@ -95,6 +103,7 @@ CREATE TABLE IF NOT EXISTS recuperacao_senha (
     PRIMARY KEY (id),
     UNIQUE KEY uq_token (token),
     INDEX idx_usuario (usuario_id),
+    INDEX idx_expira  (expira_em),
     CONSTRAINT fk_rec_usuario
         FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
@@ -142,6 +151,8 @@ CREATE TABLE IF NOT EXISTS categorias (
 """
 
 # ── 05. Produtos ─────────────────────────────────────────────
+# nota_media, total_avaliacoes e avaliacoes_1..5 (histograma) são mantidos
+# pelo app ao aprovar avaliações. Reconstrução: reconstruir-avaliacoes.
 TABELAS_ECOMMERCE["produtos"] = """
 CREATE TABLE IF NOT EXISTS produtos (
     id                  INT UNSIGNED  NOT NULL AUTO_INCREMENT,
@@ -158,6 +169,13 @@ CREATE TABLE IF NOT EXISTS produtos (
     peso_gramas         INT UNSIGNED  DEFAULT NULL,
     ativo               TINYINT(1)    NOT NULL DEFAULT 1,
     destaque            TINYINT(1)    NOT NULL DEFAULT 0,
+    nota_media          DECIMAL(3,2)  NOT NULL DEFAULT 0.00,
+    total_avaliacoes    INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_1        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_2        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_3        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_4        INT UNSIGNED  NOT NULL DEFAULT 0,
+    avaliacoes_5        INT UNSIGNED  NOT NULL DEFAULT 0,
     criado_em           DATETIME      NOT NULL DEFAULT CURRENT_TIMESTAMP,
     atualizado_em       DATETIME      NOT NULL DEFAULT CURRENT_TIMESTAMP
                                       ON UPDATE CURRENT_TIMESTAMP,
@@ -166,6 +184,7 @@ CREATE TABLE IF NOT EXISTS produtos (
     INDEX idx_categoria (categoria_id),
     INDEX idx_ativo     (ativo),
     INDEX idx_destaque  (destaque),
+    INDEX idx_vitrine   (ativo, destaque, id),
     CONSTRAINT fk_prod_categoria
         FOREIGN KEY (categoria_id) REFERENCES categorias(id) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
@@ -267,6 +286,7 @@ CREATE TABLE IF NOT EXISTS pedidos (
     INDEX idx_usuario (usuario_id),
     INDEX idx_status  (status),
     INDEX idx_criado  (criado_em),
+    INDEX idx_status_criado (status, criado_em, id),
     CONSTRAINT fk_ped_usuario
         FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE SET NULL,
     CONSTRAINT fk_ped_cupom
@@ -329,6 +349,8 @@ CREATE TABLE IF NOT EXISTS avaliacoes (
     PRIMARY KEY (id),
     INDEX idx_produto  (produto_id),
     INDEX idx_aprovada (aprovada),
+    INDEX idx_criado   (criado_em, id),
+    INDEX idx_produto_aprovada (produto_id, aprovada, criado_em, id),
     CONSTRAINT chk_nota CHECK (nota BETWEEN 1 AND 5),
     CONSTRAINT fk_av_produto
         FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE,
@@ -349,7 +371,8 @@ CREATE TABLE IF NOT EXISTS contatos (
     respondida  TINYINT(1)   NOT NULL DEFAULT 0,
     criado_em   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (id),
-    INDEX idx_lida (lida)
+    INDEX idx_lida   (lida),
+    INDEX idx_criado (criado_em, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
@@ -363,6 +386,72 @@ CREATE TABLE IF NOT EXISTS configuracoes (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
+# ── 15. Resumo financeiro diário (mantido pelo app) ──────────
+# Um registro por dia × forma de pagamento × status; lido pelo
+# /api/admin/financeiro. Reconstrução: reconstruir-financeiro.
+TABELAS_ECOMMERCE["resumo_diario_pedidos"] = """
+CREATE TABLE IF NOT EXISTS resumo_diario_pedidos (
+    dia              DATE          NOT NULL,
+    forma_pagamento  VARCHAR(20)   NOT NULL,
+    status           VARCHAR(30)   NOT NULL,
+    status_pagamento VARCHAR(20)   NOT NULL,
+    pedidos          INT           NOT NULL DEFAULT 0,
+    total            DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (dia, forma_pagamento, status, status_pagamento)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+TABELAS_ECOMMERCE["resumo_diario_despesas"] = """
+CREATE TABLE IF NOT EXISTS resumo_diario_despesas (
+    dia        DATE          NOT NULL,
+    categoria  VARCHAR(30)   NOT NULL,
+    despesas   INT           NOT NULL DEFAULT 0,
+    total      DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (dia, categoria)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# ── 16. Fila de e-mails (outbox) ──────────────────────────────
+# Gravada pelas rotas; enviada em segundo plano pelo app.
+TABELAS_ECOMMERCE["email_fila"] = """
+CREATE TABLE IF NOT EXISTS email_fila (
+    id                INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    destinatario      VARCHAR(150) NOT NULL,
+    assunto           VARCHAR(200) NOT NULL,
+    html              MEDIUMTEXT   NOT NULL,
+    status            ENUM('pendente','enviando','enviado','falhou')
+                      NOT NULL DEFAULT 'pendente',
+    tentativas        INT UNSIGNED NOT NULL DEFAULT 0,
+    ultimo_erro       VARCHAR(500) DEFAULT NULL,
+    proxima_tentativa DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    enviado_em        DATETIME     DEFAULT NULL,
+    criado_em         DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    atualizado_em     DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+                                   ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    INDEX idx_fila (status, proxima_tentativa)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# ── 17. Log de atividades ────────────────────────────────────
+# Auditoria de ações. Particionada por mês e preservada entre
+# execuções; retenção via: python criar_bd_admin.py manutencao
+TABELAS_ECOMMERCE["log_atividades"] = """
+CREATE TABLE IF NOT EXISTS log_atividades (
+    id          INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    usuario_id  INT UNSIGNED DEFAULT NULL,
+    acao        VARCHAR(100) NOT NULL,
+    descricao   TEXT         DEFAULT NULL,
+    ip          VARCHAR(45)  DEFAULT NULL,
+    criado_em   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, criado_em),
+    INDEX idx_log_usuario (usuario_id),
+    INDEX idx_log_criado  (criado_em)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE COLUMNS (criado_em) (
+    PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+)
+"""
 
 # ================================================================
 #  SEÇÃO 2 — TABELAS DO PAINEL ADMIN
@@ -400,25 +489,60 @@ CREATE TABLE despesas (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
-# ── A2. Log de atividades ─────────────────────────────────────
-# Página: todas as páginas admin (auditoria de ações)
-# Registra quem fez o quê e quando no painel.
-TABELAS_ADMIN["log_atividades"] = """
-CREATE TABLE log_atividades (
-    id          INT UNSIGNED NOT NULL AUTO_INCREMENT,
-    usuario_id  INT UNSIGNED DEFAULT NULL,
-    acao        VARCHAR(100) NOT NULL,
-    descricao   TEXT         DEFAULT NULL,
-    ip          VARCHAR(45)  DEFAULT NULL,
-    criado_em   DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    PRIMARY KEY (id),
-    INDEX idx_log_usuario (usuario_id),
-    INDEX idx_log_criado  (criado_em),
-    CONSTRAINT fk_log_usuario
-        FOREIGN KEY (usuario_id)
-        REFERENCES usuarios(id) ON DELETE SET NULL
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-"""
+
+# ================================================================
+#  ÍNDICES E COLUNAS ADICIONAIS
+#  CREATE TABLE IF NOT EXISTS não altera tabelas antigas: estes
+#  índices e colunas são adicionados à parte quando ainda não existem.
+# ================================================================
+
+# (tabela, nome do índice, colunas)
+INDICES = [
+    ("usuarios",          "idx_criado",           "criado_em, id"),
+    ("produtos",          "idx_vitrine",          "ativo, destaque, id"),
+    ("pedidos",           "idx_status_criado",    "status, criado_em, id"),
+    ("avaliacoes",        "idx_criado",           "criado_em, id"),
+    ("avaliacoes",        "idx_produto_aprovada", "produto_id, aprovada, criado_em, id"),
+    ("contatos",          "idx_criado",           "criado_em, id"),
+    ("recuperacao_senha", "idx_expira",           "expira_em"),
+]
+
+
+def criar_indices(cur):
+    for tabela, nome, colunas in INDICES:
+        cur.execute(
+            """SELECT 1 FROM information_schema.statistics
+               WHERE table_schema = DATABASE()
+                 AND table_name = %s AND index_name = %s
+               LIMIT 1""",
+            (tabela, nome)
+        )
+        if cur.fetchone():
+            continue
+        cur.execute(f"ALTER TABLE `{tabela}` ADD INDEX `{nome}` ({colunas})")
+        print(f"  ✔  {tabela}.{nome}  ← índice criado")
+
+
+# (tabela, coluna, definição) — agregados de avaliações em produtos
+COLUNAS = [
+    ("produtos", "nota_media",       "DECIMAL(3,2) NOT NULL DEFAULT 0.00"),
+    ("produtos", "total_avaliacoes", "INT UNSIGNED NOT NULL DEFAULT 0"),
+] + [("produtos", f"avaliacoes_{n}", "INT UNSIGNED NOT NULL DEFAULT 0") for n in range(1, 6)]
+
+
+def criar_colunas(cur):
+    for tabela, coluna, definicao in COLUNAS:
+        cur.execute(
+            """SELECT 1 FROM information_schema.columns
+               WHERE table_schema = DATABASE()
+                 AND table_name = %s AND column_name = %s
+               LIMIT 1""",
+            (tabela, coluna)
+        )
+        if cur.fetchone():
+            continue
+        cur.execute(f"ALTER TABLE `{tabela}` ADD COLUMN `{coluna}` {definicao}")
+        print(f"  ✔  {tabela}.{coluna}  ← coluna criada")
 
 
 # ================================================================
@@ -665,6 +789,10 @@ def main():
             except pymysql.Error as e:
                 print(f"  ❌  {nome}: {e}")
                 raise
+        criar_colunas(cur)
+        criar_indices(cur)
+        particionar_log_atividades(cur)
+        conn.commit()
 
         # ── PASSO 2: Tabelas do admin ─────────────────────────
         separador()
@@ -686,6 +814,11 @@ def main():
         inserir_dados_iniciais(cur)
         conn.commit()
 
+        # despesas foi recriada: o resumo diário precisa ser recalculado
+        reconstruir_resumo_financeiro(cur)
+        reconstruir_avaliacoes(cur)
+        conn.commit()
+
         cur.execute("SET FOREIGN_KEY_CHECKS = 1")
         conn.commit()
 
@@ -734,4 +867,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        executar_comando(sys.argv[1], DB)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+================================================================
+  SPINASSI CHOCOLATES — Manutenção do banco de dados
+  Rotinas compartilhadas por criar_bd.py e criar_bd_admin.py:
+  reconstrução dos agregados (financeiro, avaliações) e retenção
+  (partições de log_atividades, tokens de recuperação de senha).
+
+  Uso:
+      python criar_bd.py <comando>
+      python criar_bd_admin.py <comando>
+================================================================
+"""
+
+import sys
+import time
+import pymysql
+from datetime import date, datetime, timedelta
+
+
+def reconstruir_resumo_financeiro(cur):
+    """Recalcula do zero o resumo diário de pedidos e despesas (backfill)."""
+    cur.execute("DELETE FROM resumo_diario_pedidos")
+    cur.execute(
+        """INSERT INTO resumo_diario_pedidos
+               (dia, forma_pagamento, status, status_pagamento, pedidos, total)
+           SELECT DATE(criado_em), forma_pagamento, status, status_pagamento,
+                  COUNT(*), SUM(total)
+           FROM pedidos
+           GROUP BY DATE(criado_em), forma_pagamento, status, status_pagamento"""
+    )
+    print(f"  ✔  resumo_diario_pedidos  {cur.rowcount} linha(s)")
+    cur.execute("DELETE FROM resumo_diario_despesas")
+    cur.execute(
+        """INSERT INTO resumo_diario_despesas (dia, categoria, despesas, total)
+           SELECT data_despesa, categoria, COUNT(*), SUM(valor)
+           FROM despesas
+           GROUP BY data_despesa, categoria"""
+    )
+    print(f"  ✔  resumo_diario_despesas {cur.rowcount} linha(s)")
+
+
+def reconstruir_avaliacoes(cur):
+    """
+    Recalcula do zero nota_media, total_avaliacoes e o histograma
+    (avaliacoes_1..5) de cada produto a partir das avaliações aprovadas.
+    """
+    cur.execute(
+        """UPDATE produtos p
+           LEFT JOIN (SELECT produto_id, COUNT(*) AS total, AVG(nota) AS media,
+                             SUM(nota = 1) AS n1, SUM(nota = 2) AS n2, SUM(nota = 3) AS n3,
+                             SUM(nota = 4) AS n4, SUM(nota = 5) AS n5
+                      FROM avaliacoes
+                      WHERE aprovada = 1
+                      GROUP BY produto_id) a ON a.produto_id = p.id
+           SET p.total_avaliacoes = COALESCE(a.total, 0),
+               p.nota_media       = COALESCE(ROUND(a.media, 2), 0),
+               p.avaliacoes_1     = COALESCE(a.n1, 0),
+               p.avaliacoes_2     = COALESCE(a.n2, 0),
+               p.avaliacoes_3     = COALESCE(a.n3, 0),
+               p.avaliacoes_4     = COALESCE(a.n4, 0),
+               p.avaliacoes_5     = COALESCE(a.n5, 0)"""
+    )
+    print(f"  ✔  produtos: agregados de avaliações recalculados ({cur.rowcount} alterado(s))")
+
+
+# ── Retenção: log_atividades e recuperacao_senha ────────────
+# log_atividades é particionada por mês (RANGE em criado_em):
+# apagar um mês antigo é um DROP PARTITION, sem varrer a tabela.
+LOG_RETENCAO_MESES = 12    # meses de log mantidos
+LOG_MESES_A_FRENTE = 3     # partições criadas com antecedência
+EXPURGO_LOTE       = 5000  # linhas por DELETE em recuperacao_senha
+
+
+def _mes_seguinte(d):
+    return (d.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _particoes_log(cur):
+    cur.execute(
+        """SELECT partition_name AS nome FROM information_schema.partitions
+           WHERE table_schema = DATABASE() AND table_name = 'log_atividades'
+             AND partition_name IS NOT NULL"""
+    )
+    return {r["nome"] for r in cur.fetchall()}
+
+
+def _definicao_particoes(meses):
+    return ", ".join(
+        f"PARTITION p{m:%Y%m} VALUES LESS THAN ('{_mes_seguinte(m):%Y-%m-%d}')"
+        for m in meses
+    ) + ", PARTITION p_futuro VALUES LESS THAN (MAXVALUE)"
+
+
+def particionar_log_atividades(cur):
+    """Garante o particionamento mensal e as partições dos próximos meses."""
+    hoje = date.today().replace(day=1)
+    limite = hoje
+    for _ in range(LOG_MESES_A_FRENTE):
+        limite = _mes_seguinte(limite)
+
+    existentes = _particoes_log(cur)
+    if not existentes:
+        # Tabela criada por versões antigas: FK e PK simples impedem particionar
+        cur.execute(
+            """SELECT constraint_name AS nome FROM information_schema.table_constraints
+               WHERE table_schema = DATABASE() AND table_name = 'log_atividades'
+                 AND constraint_type = 'FOREIGN KEY'"""
+        )
+        for r in cur.fetchall():
+            cur.execute(f"ALTER TABLE log_atividades DROP FOREIGN KEY `{r['nome']}`")
+        cur.execute("SELECT MIN(criado_em) AS inicio FROM log_atividades")
+        inicio = cur.fetchone()["inicio"]
+        mes = min(hoje, inicio.date().replace(day=1)) if inicio else hoje
+        meses = []
+        while mes <= limite:
+            meses.append(mes)
+            mes = _mes_seguinte(mes)
+        cur.execute("ALTER TABLE log_atividades DROP PRIMARY KEY, ADD PRIMARY KEY (id, criado_em)")
+        cur.execute(
+            f"ALTER TABLE log_atividades PARTITION BY RANGE COLUMNS (criado_em) "
+            f"({_definicao_particoes(meses)})"
+        )
+        print(f"  ✔  log_atividades particionada ({len(meses)} mês(es))")
+        return
+
+    # Só é possível acrescentar meses depois da última partição existente
+    ultimos = sorted(n for n in existentes if n != "p_futuro")
+    mes = _mes_seguinte(datetime.strptime(ultimos[-1][1:], "%Y%m").date()) if ultimos else hoje
+    novos = []
+    while mes <= limite:
+        novos.append(mes)
+        mes = _mes_seguinte(mes)
+    if novos:
+        cur.execute(
+            f"ALTER TABLE log_atividades REORGANIZE PARTITION p_futuro INTO "
+            f"({_definicao_particoes(novos)})"
+        )
+        print(f"  ✔  log_atividades: {len(novos)} partição(ões) nova(s)")
+
+
+def expurgar_log_atividades(cur):
+    """Remove as partições mais antigas que LOG_RETENCAO_MESES."""
+    corte = date.today().replace(day=1)
+    for _ in range(LOG_RETENCAO_MESES):
+        corte = (corte - timedelta(days=1)).replace(day=1)
+    antigas = sorted(n for n in _particoes_log(cur)
+                     if n != "p_futuro" and n[1:] < f"{corte:%Y%m}")
+    if antigas:
+        cur.execute(f"ALTER TABLE log_atividades DROP PARTITION {', '.join(antigas)}")
+    print(f"  ✔  log_atividades: {len(antigas)} partição(ões) antiga(s) removida(s)")
+
+
+def expurgar_tokens_senha(cur):
+    """Apaga tokens de recuperação expirados ou já usados, em lotes curtos (sem travar a tabela)."""
+    total = 0
+    while True:
+        cur.execute(
+            "DELETE FROM recuperacao_senha WHERE expira_em < NOW() OR usado = 1 LIMIT %s",
+            (EXPURGO_LOTE,)
+        )
+        cur.connection.commit()
+        total += cur.rowcount
+        if cur.rowcount < EXPURGO_LOTE:
+            break
+        time.sleep(0.2)
+    print(f"  ✔  recuperacao_senha: {total} token(s) expirado(s)/usado(s) removido(s)")
+
+
+def manutencao(cur):
+    particionar_log_atividades(cur)
+    expurgar_log_atividades(cur)
+    expurgar_tokens_senha(cur)
+
+
+COMANDOS = {
+    "reconstruir-financeiro": reconstruir_resumo_financeiro,
+    "reconstruir-avaliacoes": reconstruir_avaliacoes,
+    "manutencao":             manutencao,
+}
+
+
+def executar_comando(nome, db):
+    """Roda um dos COMANDOS numa conexão própria com a configuração `db`."""
+    if nome not in COMANDOS:
+        print(f"  ❌  Comando desconhecido: {nome}")
+        print(f"      Disponíveis: {', '.join(COMANDOS)}")
+        sys.exit(1)
+    conn = pymysql.connect(**db, cursorclass=pymysql.cursors.DictCursor)
+    try:
+        with conn.cursor() as cur:
+            COMANDOS[nome](cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()